@@ -0,0 +1,55 @@
+"""Compare per-byte diff of readback with the image against the big integer XOR diff used by verification.
+
+    python -m benchmarks.bench_diff [--size 20480] [--repeat 50] [--errors 40]
+"""
+import argparse
+import random
+import time
+
+from flashloader.hex_processing import mismatched_ranges
+
+
+def mismatched_ranges_loop(expected: bytes, actual: bytes):
+    """Straightforward implementation walking both buffers byte by byte."""
+    ranges, start = [], None
+    for address, (left, right) in enumerate(zip(expected, actual)):
+        if left != right and start is None:
+            start = address
+        elif left == right and start is not None:
+            ranges.append((start, address))
+            start = None
+    if start is not None:
+        ranges.append((start, len(expected)))
+    return ranges
+
+
+def measure(diff, expected: bytes, actual: bytes, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        ranges = diff(expected, actual)
+    return (time.perf_counter() - started) / repeat, ranges
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=20480)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--errors', type=int, default=40)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    expected = bytes(rng.randrange(256) for _ in range(args.size))
+    actual = bytearray(expected)
+    for address in rng.sample(range(args.size), args.errors):
+        actual[address] ^= 0xFF
+    actual = bytes(actual)
+
+    print(f'{"loop, ms":>10} {"xor, ms":>10} {"speedup":>8} {"ranges":>7} {"same":>6}')
+    loop, expected_ranges = measure(mismatched_ranges_loop, expected, actual, args.repeat)
+    fast, ranges = measure(mismatched_ranges, expected, actual, args.repeat)
+    print(f'{loop * 1e3:>10.3f} {fast * 1e3:>10.3f} {loop / fast:>7.1f}x {len(ranges):>7} '
+          f'{str(ranges == expected_ranges):>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Latency and throughput of flasher operations against the EZDL emulator, for every supported chip.
+
+Runs without a programmer attached, so performance changes can be measured in CI:
+
+    python -m benchmarks.bench_emulator [--baudrate 115200] [--latency 0.0] [--window 64] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from flashloader.constants import Ecode, MCUMemorySize, SupportedMCU
+from flashloader.ezdl import EZDLFlasher
+from flashloader.ezdl.emulator import EZDLEmulator
+from flashloader.hex_processing import FirmwareImage
+
+
+def measure(emulator: EZDLEmulator, name: str, size: int, action) -> dict:
+    emulator.reset_stats()
+    started = time.perf_counter()
+    result = action()
+    elapsed = time.perf_counter() - started
+    if isinstance(result, Ecode) and result != Ecode.OK:
+        raise RuntimeError(f'{name} failed: {result.value}')
+    return {
+        'operation': name,
+        'seconds': round(elapsed, 4),
+        'bytes_per_second': round(size / elapsed) if size else None,
+        'commands': sum(emulator.commands.values()),
+        'bytes_received': emulator.bytes_received,
+        'bytes_sent': emulator.bytes_sent,
+    }
+
+
+def bench_mcu(mcu: SupportedMCU, args: argparse.Namespace, directory: str) -> list:
+    size = MCUMemorySize[mcu]
+    rng = random.Random(size)
+    image = FirmwareImage(bytes(rng.getrandbits(8) for _ in range(size)))
+    dump_path = os.path.join(directory, f'{mcu.value}.hex')
+    flasher = EZDLFlasher(verbose=False)
+    results = []
+    with EZDLEmulator(mcu, baudrate=args.baudrate, latency=args.latency) as emulator:
+        results.append(measure(emulator, 'connect', 0, lambda: flasher.connect(emulator.device, args.baudrate)))
+        if not args.skip_per_byte:
+            results.append(measure(emulator, 'write', size, lambda: flasher.write(image)))
+        results.append(measure(emulator, f'write --burst {args.window}', size,
+                               lambda: flasher.write(image, window=args.window)))
+        results.append(measure(emulator, 'write --if-changed', size, lambda: flasher.write(image, if_changed=True)))
+        results.append(measure(emulator, 'verify', size, lambda: flasher.verify(image)))
+        # Rows below must measure transfers from the chip, not memory read back by the rows above.
+        flasher.refresh()
+        results.append(measure(emulator, 'verify --full', size, lambda: flasher.verify(image, full=True)))
+        flasher.refresh()
+        results.append(measure(emulator, 'read', size, lambda: flasher.read(dump_path)))
+        flasher.disconnect()
+    for result in results:
+        result['mcu'] = mcu.value
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--latency', type=float, default=0.0, help='adapter turnaround time, seconds')
+    parser.add_argument('--window', type=int, default=64, help='burst write window, bytes')
+    parser.add_argument('--skip-per-byte', action='store_true', help='skip slow per-byte write')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [result for mcu in SupportedMCU for result in bench_mcu(mcu, args, directory)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f'{"mcu":>6} {"operation":>20} {"seconds":>9} {"bytes/s":>9} {"commands":>9} {"rx":>7} {"tx":>7}')
+    for r in results:
+        print(f'{r["mcu"]:>6} {r["operation"]:>20} {r["seconds"]:>9.3f} {r["bytes_per_second"] or "-":>9} '
+              f'{r["commands"]:>9} {r["bytes_received"]:>7} {r["bytes_sent"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
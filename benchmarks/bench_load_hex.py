@@ -0,0 +1,59 @@
+"""Compare IntelHex based hex loading with the streaming parser on large and sparse memory images.
+
+Both loaders must return the same image, which is checked for every case.
+
+    python -m benchmarks.bench_load_hex [--size 20480] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from intelhex import IntelHex
+
+from flashloader.hex_processing import load_hex, save_hex
+
+
+def load_hex_intelhex(path: str) -> bytes:
+    """Previous implementation: per-byte dictionary flattened by tobinstr."""
+    ih = IntelHex()
+    ih.loadhex(path)
+    return ih.tobinstr(start=0)
+
+
+def make_images(size: int):
+    rng = random.Random(0)
+    large = bytes(rng.randrange(256) for _ in range(size))
+    sparse = bytearray(b'\xff' * size)
+    for start in range(0, size, 2048):
+        sparse[start:start + 300] = bytes(rng.randrange(256) for _ in range(300))
+    return {'large': large, 'sparse': bytes(sparse)}
+
+
+def measure(load, path: str, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        data = load(path)
+    return (time.perf_counter() - started) / repeat, bytes(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=20480)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'{"image":>8} {"intelhex, ms":>14} {"streaming, ms":>14} {"speedup":>8} {"same":>6}')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'image.hex')
+        for name, binstr in make_images(args.size).items():
+            save_hex(path, binstr)
+            legacy, expected = measure(load_hex_intelhex, path, args.repeat)
+            fast, loaded = measure(load_hex, path, args.repeat)
+            print(f'{name:>8} {legacy * 1e3:>14.2f} {fast * 1e3:>14.2f} {legacy / fast:>7.1f}x '
+                  f'{str(loaded == expected):>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Compare per-byte and burst LOAD_FIRMWARE transfers against an in-process programmer model.
+
+Line time is modelled: every blocking read costs one adapter turnaround plus the time of the received bytes
+on the wire, every write costs the time of the written bytes.
+
+    python -m benchmarks.bench_send_data [--baudrate 9600] [--latency 0.002] [--size 20480]
+"""
+import argparse
+import time
+
+from flashloader.ezdl.enums import ActionSignals, Commands
+from flashloader.ezdl.utils import send_data
+
+FOOTER = b'\n\r ok\n\r >'
+
+
+class FakeProgrammer:
+    def __init__(self, size: int, baudrate: int, latency: float):
+        self.remaining = size
+        self.byte_time = 10 / baudrate
+        self.latency = latency
+        self.line_time = 0.0
+        self._out = bytearray()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._out)
+
+    def flushInput(self):
+        pass
+
+    def flushOutput(self):
+        pass
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.line_time += len(data) * self.byte_time
+        if data == Commands.LOAD_FIRMWARE:
+            self._out += data + ActionSignals.XON
+            return 1
+
+        for _ in data:
+            self.remaining -= 1
+            self._out += ActionSignals.XOFF
+            self._out += ActionSignals.XON if self.remaining else FOOTER
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        self.line_time += self.latency + size * self.byte_time
+        data, self._out = bytes(self._out[:size]), self._out[size:]
+        return data
+
+    def read_until(self, expected: bytes = b'\n') -> bytes:
+        idx = self._out.find(expected) + len(expected)
+        return self.read(idx)
+
+
+def run(size: int, baudrate: int, latency: float, window: int):
+    dev = FakeProgrammer(size, baudrate, latency)
+    started = time.perf_counter()
+    send_data(dev, Commands.LOAD_FIRMWARE, b'\x5a' * size, action_check=True, window=window)
+    return time.perf_counter() - started, dev.line_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--size', type=int, default=20480)
+    args = parser.parse_args()
+
+    print(f'{"window":>8} {"cpu, s":>10} {"line, s":>10} {"bytes/s":>10}')
+    for window in (0, 16, 64, 256):
+        cpu, line = run(args.size, args.baudrate, args.latency, window)
+        print(f'{window or "per-byte":>8} {cpu:>10.3f} {line:>10.1f} {args.size / line:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Compare per-unit image preparation: hex file generated and loaded for every unit against patching a copy.
+
+Every patched image is checked against the image decoded from the generated file, including checksum and
+occupied length corrected by the patched ranges only.
+
+    python -m benchmarks.bench_serialize [--size 20480] [--units 200]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from flashloader.hex_processing import FirmwareImage, load_hex, save_hex
+from flashloader.serialization import ImagePatcher, SerialCounter
+
+CALIBRATION_ADDRESS = 0x3F00
+CALIBRATION_SIZE = 32
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=20480)
+    parser.add_argument('--units', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    base = bytes(rng.randrange(256) for _ in range(args.size // 2)) + b'\xff' * (args.size - args.size // 2)
+    counter = SerialCounter(args.size // 2 - 4, start=1000, fmt='le4')
+    units = []
+    for _ in range(args.units):
+        units.append([counter.patch(), (CALIBRATION_ADDRESS, bytes(rng.randrange(256) for _ in range(CALIBRATION_SIZE)))])
+        counter.advance()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'unit.hex')
+        expected = []
+        started = time.perf_counter()
+        for patches in units:
+            data = bytearray(base)
+            for address, payload in patches:
+                data[address:address + len(payload)] = payload
+            save_hex(path, data)
+            expected.append(FirmwareImage(load_hex(path)))
+        legacy = (time.perf_counter() - started) / args.units
+
+    patcher = ImagePatcher(FirmwareImage(base))
+    same = True
+    patched_time = 0.0
+    for patches, reference in zip(units, expected):
+        started = time.perf_counter()
+        image = patcher.apply(patches)
+        patched_time += time.perf_counter() - started
+        same &= (bytes(image.data).rstrip(b'\xff') == bytes(reference.data).rstrip(b'\xff')
+                 and image.occupied == reference.occupied
+                 and image.checksum == FirmwareImage(bytes(image.data)).checksum)
+    patched = patched_time / args.units
+
+    print(f'{"hex per unit, ms":>17} {"patched, ms":>12} {"speedup":>8} {"same":>6}')
+    print(f'{legacy * 1e3:>17.3f} {patched * 1e3:>12.3f} {legacy / patched:>7.0f}x {str(same):>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Measure start time of the tool, the cost paid by batch scripts launching it once per board.
+
+Every case runs in a fresh interpreter, the median of `--repeat` runs is reported together with the heavy
+third party modules the case imported.
+
+    python -m benchmarks.bench_startup [--repeat 20]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('serial', 'intelhex', 'pydantic', 'asyncio')
+REPORT = f'import sys; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+
+CASES = {
+    'interpreter': 'pass',
+    'import run': 'import flashloader.run',
+    'shell ready': 'from flashloader.cli import FlasherCLI; FlasherCLI()',
+    'batch ready': 'from flashloader.batch import BatchRunner; BatchRunner()',
+}
+
+
+def measure(code: str, repeat: int):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    modules = subprocess.run([sys.executable, '-c', f'{code}\n{REPORT}'], check=True, capture_output=True,
+                             text=True).stdout.strip()
+    return statistics.median(times), modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'{"case":>12} {"median, ms":>11}  heavy modules')
+    for name, code in CASES.items():
+        median, modules = measure(code, args.repeat)
+        print(f'{name:>12} {median * 1e3:>11.1f}  {modules or "-"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import json
+import logging
+import shlex
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .cli.utils import parse_address, parse_options
+from .constants import Ecode
+from .ezdl import EZDLFlasher
+
+logger = logging.getLogger(__name__)
+
+EXIT_OK = 0
+EXIT_STEP_FAILED = 1
+EXIT_INVALID_JOB = 2
+
+# Step name: flasher method, positional argument names, options with their types.
+STEPS = {
+    'connect': ('connect', ('device',), {'baudrate': int, 'timeout': float, 'probe': bool}),
+    'disconnect': ('disconnect', (), {}),
+    'refresh': ('refresh', (), {}),
+    'title': ('get_title', (), {}),
+    'info': ('get_info', (), {}),
+    'pgm': ('get_pgm', (), {}),
+    'checksum': ('get_checksum', (), {}),
+    'set_cursor': ('set_cursor', ('position',), {}),
+    'erase': ('erase', (), {}),
+    'write': ('write', ('path',), {'window': int, 'if_changed': bool, 'full_verify': bool, 'patches': str,
+                                   'serialize': bool}),
+    'serial': ('set_serial', ('address',), {'start': int, 'step': int, 'fmt': str}),
+    'verify': ('verify', ('path',), {'full': bool}),
+    'diff': ('diff', ('path',), {'recheck': bool}),
+    'read': ('read', ('path',), {'occupied': bool, 'start': parse_address, 'length': parse_address,
+                                 'min_padding': int}),
+}
+# Command line spelling of options which differ from flasher arguments.
+OPTION_ALIASES = {'burst': 'window', 'format': 'fmt'}
+
+Step = Dict[str, Any]
+
+
+def parse_step(line: str) -> Union[Step, Ecode]:
+    """Step from interactive shell syntax, like `write image.hex --if-changed`."""
+    try:
+        name, *rest = shlex.split(line)
+    except ValueError:
+        return Ecode.PROCESSING_ARGUMENT_FAILED
+    if name not in STEPS:
+        logger.error(f'Unknown step: {name}.')
+        return Ecode.PROCESSING_ARGUMENT_FAILED
+
+    _, positional, options = STEPS[name]
+    aliases = {alias: options[target] for alias, target in OPTION_ALIASES.items() if target in options}
+    parsed = parse_options(shlex.join(rest), {**options, **aliases})
+    if isinstance(parsed, Ecode):
+        return parsed
+    args, kwargs = parsed
+    if len(args) != len(positional):
+        logger.error(f'Step {name} expects arguments: {", ".join(positional) or "none"}.')
+        return Ecode.EMPTY_ARGUMENT
+
+    step = {OPTION_ALIASES.get(key, key): value for key, value in kwargs.items()}
+    step.update(zip(positional, args))
+    if name == 'set_cursor':
+        step['position'] = parse_address(step['position'])
+    elif name == 'serial':
+        step['address'] = parse_address(step['address'])
+    step['command'] = name
+    return step
+
+
+def load_job(path: str) -> Union[Tuple[List[Step], bool], Ecode]:
+    """Steps and stop-on-error flag from JSON job file: {"steps": [{"command": "write", "path": ...}, ...]}."""
+    try:
+        with open(path) as file:
+            job = json.load(file)
+        steps = job['steps']
+        if not all(isinstance(step, dict) and step.get('command') in STEPS for step in steps):
+            raise ValueError('every step must be an object with known command')
+    except FileNotFoundError:
+        return Ecode.FILE_NOT_EXIST
+    except Exception as ex:
+        logger.error(f'Invalid job file {path}: {ex}.')
+        return Ecode.PROCESSING_ARGUMENT_FAILED
+    else:
+        return steps, job.get('stop_on_error', True)
+
+
+def to_json_value(value: Any) -> Any:
+    if isinstance(value, Ecode):
+        return None
+    if hasattr(value, 'dict'):
+        return value.dict()
+    return value
+
+
+class BatchRunner:
+    """Runs job steps in a single flasher session and collects machine readable results."""
+
+    def __init__(self, flasher: Optional[EZDLFlasher] = None):
+        self.flasher = flasher if flasher is not None else EZDLFlasher(verbose=False)
+
+    def run_step(self, step: Step) -> Dict[str, Any]:
+        method, positional, options = STEPS[step['command']]
+        kwargs = {key: value for key, value in step.items() if key != 'command'}
+        unknown = set(kwargs) - set(positional) - set(options)
+        started = time.perf_counter()
+        if unknown:
+            logger.error(f'Unknown arguments of {step["command"]}: {", ".join(sorted(unknown))}.')
+            result = Ecode.PROCESSING_ARGUMENT_FAILED
+        else:
+            try:
+                result = getattr(self.flasher, method)(**kwargs)
+            except Exception as ex:
+                logger.error(f'Step {step["command"]} failed: {ex}.')
+                result = Ecode.UNEXPECTED_ERROR
+        ecode = result if isinstance(result, Ecode) else Ecode.OK
+        return {
+            'command': step['command'],
+            'ok': ecode == Ecode.OK,
+            'ecode': ecode.name,
+            'message': ecode.value,
+            'result': to_json_value(result),
+            'seconds': round(time.perf_counter() - started, 4),
+        }
+
+    def run(self, steps: List[Step], stop_on_error: bool = True) -> Dict[str, Any]:
+        results = []
+        for step in steps:
+            results.append(self.run_step(step))
+            if stop_on_error and not results[-1]['ok']:
+                break
+        if self.flasher.device is not None:
+            self.flasher.disconnect()
+        ok = len(results) == len(steps) and all(result['ok'] for result in results)
+        return {'ok': ok, 'steps': results}
+
+
+def run_batch(job_path: Optional[str] = None, lines: Optional[List[str]] = None, keep_going: bool = False,
+              socket_path: Optional[str] = None) -> int:
+    """Run job file or command lines, print JSON report and return process exit code.
+
+    With `socket_path` the steps are run by the flasher daemon listening on it.
+    """
+    steps, stop_on_error = [], not keep_going
+    if job_path is not None:
+        job = load_job(job_path)
+        if isinstance(job, Ecode):
+            print(json.dumps({'ok': False, 'ecode': job.name, 'message': job.value}))
+            return EXIT_INVALID_JOB
+        steps, stop_on_error = job[0], job[1] and not keep_going
+    for line in lines or []:
+        step = parse_step(line)
+        if isinstance(step, Ecode):
+            print(json.dumps({'ok': False, 'ecode': step.name, 'message': step.value, 'step': line}))
+            return EXIT_INVALID_JOB
+        steps.append(step)
+
+    if socket_path is None:
+        report = BatchRunner().run(steps, stop_on_error)
+    else:
+        from .daemon import DaemonRunner
+
+        try:
+            report = DaemonRunner(socket_path).run(steps, stop_on_error)
+        except OSError as ex:
+            ecode = Ecode.CONNECTION_ERROR
+            print(json.dumps({'ok': False, 'ecode': ecode.name, 'message': f'{ecode.value} {ex}'}))
+            return EXIT_STEP_FAILED
+    print(json.dumps(report, indent=2))
+    return EXIT_OK if report['ok'] else EXIT_STEP_FAILED
@@ -1,13 +1,23 @@
+import inspect
 import logging
 from cmd import Cmd
+from typing import List, Optional
 
 from flashloader.constants import Ecode
 from flashloader.ezdl import EZDLFlasher, InfoMessage, PGMMessage
+from flashloader.ezdl.utils import OperationCancelled
 
-from .utils import handle_ecode, parse_arg, path_completion
+from .jobs import CANCELLED, Job, JobManager
+from .utils import (expand_devices, format_diff, format_scan, format_stats, handle_ecode, parse_address, parse_arg,
+                    parse_options, path_completion, print_gang_progress, print_progress)
 
 logger = logging.getLogger('flasher')
 
+# Commands allowed while background jobs use the programmer.
+JOB_COMMANDS = {None, 'bg', 'jobs', 'wait', 'cancel', 'status', 'stats', 'help', 'exit'}
+CONNECT_OPTIONS = {'baudrate': int, 'timeout': float, 'probe': bool}
+WAIT_REFRESH = 0.5
+
 
 class FlasherCLI(EZDLFlasher, Cmd):
     intro = 'Welcome to the flashtool shell. Type help or ? to list commands.\n'
@@ -16,18 +26,67 @@ class FlasherCLI(EZDLFlasher, Cmd):
     def __init__(self):
         EZDLFlasher.__init__(self)
         Cmd.__init__(self)
+        self.jobs = JobManager(self)
+
+    def onecmd(self, line: str) -> bool:
+        command = self.parseline(line)[0]
+        if command not in JOB_COMMANDS and self.jobs.busy:
+            print('Programmer is busy with background jobs, use `wait` or `cancel` first.')
+            return False
+        try:
+            return super().onecmd(line)
+        except OperationCancelled:
+            # Cancelling is meant for background jobs, a stray request must not end the shell.
+            self.reset_cancel()
+            print('Cancelled.')
+            return False
+
+    def postcmd(self, stop: bool, line: str) -> bool:
+        for job in self.jobs.unreported():
+            if job.state == CANCELLED:
+                message = 'Cancelled.'
+            elif isinstance(job.result, Ecode):
+                message = handle_ecode(job.result)
+            else:
+                message = job.result
+            print(f'[{job.number}] {job.state}: {job.line}: {message}')
+        return stop
 
     def do_connect(self, arg: str) -> None:
-        arg = parse_arg(arg)
-        if isinstance(arg, Ecode):
-            print(f'{handle_ecode(arg)} Expected device path, like /dev/ttyUSB0.')
+        """connect <device> [--baudrate RATE] [--timeout SECONDS] [--probe]: open programmer on serial device.
+
+        --timeout limits waiting for programmer response, --probe tries baud rates from the fastest one.
+        """
+        parsed = parse_options(arg, CONNECT_OPTIONS)
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if len(args) != 1:
+            print(f'{handle_ecode(Ecode.EMPTY_ARGUMENT)} Expected device path, like /dev/ttyUSB0.')
             return
 
-        ecode = self.connect(arg)
-        message = 'Connected.' if ecode == Ecode.OK \
-            else f'Connect to {arg} failed: {handle_ecode(ecode)}'
+        ecode = self.connect(args[0], **options)
+        message = f'Connected on {self.baudrate} baud.' if ecode == Ecode.OK \
+            else f'Connect to {args[0]} failed: {handle_ecode(ecode)}'
         print(message)
 
+    def do_scan(self, arg: str) -> None:
+        """scan [device...] [--baudrate RATE] [--timeout SECONDS] [--probe]: find programmers and chips.
+
+        All serial ports of the system, or the given devices and glob patterns, are probed concurrently.
+        """
+        parsed = parse_options(arg, {'baudrate': int, 'timeout': float, 'probe': bool})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+
+        from flashloader.ezdl import scan
+
+        results = scan(expand_devices(args) if args else None, **options)
+        print(format_scan(results) if results else 'No serial ports found.')
+
     def do_disconnect(self, _) -> None:
         ecode = self.disconnect()
         message = 'Successfully disconnected.' if ecode == Ecode.OK \
@@ -35,9 +94,20 @@ class FlasherCLI(EZDLFlasher, Cmd):
         print(message)
 
     def do_status(self, _) -> None:
+        if self.jobs.busy:
+            print(f'Programmer on {self._dev.name} is busy with background jobs.')
+            return
         dev = self.device
         message = f'Programmer connected on {dev}.' if dev is not None else 'Programmer is not connected.'
         print(message)
+        if dev is not None and self._shadow.known:
+            print(f'Shadow copy holds {self._shadow.known} bytes of chip memory.')
+
+    def do_refresh(self, _) -> None:
+        """Drop cached programmer and chip state and query them again."""
+        ecode = self.refresh()
+        message = 'Session state refreshed.' if ecode == Ecode.OK else handle_ecode(ecode)
+        print(message)
 
     def do_programmer_info(self, _) -> None:
         title = self.get_title()
@@ -84,38 +154,296 @@ class FlasherCLI(EZDLFlasher, Cmd):
         print(message)
 
     def do_write(self, arg: str) -> None:
-        arg = parse_arg(arg)
-        if isinstance(arg, Ecode):
-            print(handle_ecode(arg))
+        """write <path> [--burst WINDOW] [--if-changed] [--full-verify] [--patches PATCHES] [--serialize]: erase chip,
+        write image and verify it.
+
+        Image is Intel HEX or raw binary file, detected by .hex or .bin extension or by contents.
+        --patches puts per-unit data into the image, like 0x3FF0=DEADBEEF,0x3FF8=01, --serialize puts the next
+        serial number configured by `serial` command.
+
+        With --burst firmware bytes are sent in windows of WINDOW bytes without waiting for every handshake,
+        the programmer must be able to buffer the window.
+        With --if-changed chip contents are compared with the image first and unnecessary steps are skipped.
+        Written data is verified by checksum, --full-verify reads the whole image back instead.
+        """
+        parsed = parse_options(arg, {'burst': int, 'if_changed': bool, 'full_verify': bool, 'patches': str,
+                                     'serialize': bool})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if len(args) != 1:
+            print(handle_ecode(Ecode.EMPTY_ARGUMENT))
             return
 
-        ecode = self.write(arg)
+        ecode = self.write(args[0], window=options.get('burst', 0), if_changed=options.get('if_changed', False),
+                           full_verify=options.get('full_verify', False), patches=options.get('patches', ()),
+                           serialize=options.get('serialize', False))
         message = 'Writing completed successfully.' if ecode == Ecode.OK else handle_ecode(ecode)
         print(message)
 
+    def do_serial(self, arg: str) -> None:
+        """serial [<address> [--start N] [--step N] [--format le4]]: configure serial number for write --serialize.
+
+        Formats are le<N> and be<N> for N byte integers, bcd<N> for N bytes of packed decimal digits and
+        ascii<N> for N zero padded decimal digits. Without arguments the next serial number is shown.
+        """
+        parsed = parse_options(arg, {'start': int, 'step': int, 'format': str})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if not args:
+            print(f'Next serial number: {self.serial}.' if self.serial is not None else 'Serial number is not set.')
+            return
+        try:
+            address = parse_address(args[0])
+        except ValueError:
+            print(handle_ecode(Ecode.PROCESSING_ARGUMENT_FAILED))
+            return
+
+        ecode = self.set_serial(address, options.get('start', 1), options.get('step', 1), options.get('format', 'le4'))
+        message = f'Next serial number: {self.serial}.' if ecode == Ecode.OK else handle_ecode(ecode)
+        print(message)
+
     def do_read(self, arg: str):
-        arg = parse_arg(arg)
-        if isinstance(arg, Ecode):
-            print(handle_ecode(arg))
+        """read <path> [--occupied | --start ADDRESS --length LENGTH] [--min-padding N]: save chip memory to file.
+
+        --occupied reads only non blank bytes reported by the chip, --start and --length select a memory range.
+        Path ending with .bin gets raw binary dump of the range, other paths get Intel HEX file where runs of at
+        least --min-padding 0xFF bytes (16 by default) are left out.
+        """
+        parsed = parse_options(arg, {'occupied': bool, 'start': parse_address, 'length': parse_address,
+                                     'min_padding': int})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if len(args) != 1:
+            print(handle_ecode(Ecode.EMPTY_ARGUMENT))
             return
 
-        ecode = self.read(arg)
+        ecode = self.read(args[0], progress=print_progress, **options)
         message = 'Reading memory completed successfully.' if ecode == Ecode.OK else handle_ecode(ecode)
         print(message)
 
     def do_verify(self, arg: str):
-        arg = parse_arg(arg)
-        if isinstance(arg, Ecode):
-            print(handle_ecode(arg))
+        """verify <path> [--full]: compare chip checksum with image file, --full compares the whole memory."""
+        parsed = parse_options(arg, {'full': bool})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if len(args) != 1:
+            print(handle_ecode(Ecode.EMPTY_ARGUMENT))
             return
 
-        ecode = self.verify(arg)
+        ecode = self.verify(args[0], full=options.get('full', False))
         message = 'Verify memory completed successfully.' if ecode == Ecode.OK else handle_ecode(ecode)
         print(message)
 
+    def do_diff(self, arg: str) -> None:
+        """diff <path> [--recheck]: read image range back and show addresses differing from the image.
+
+        --recheck reads differing ranges again to tell a garbled transfer from bad memory cells, only memory up to
+        the last difference is transferred.
+        """
+        parsed = parse_options(arg, {'recheck': bool})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if len(args) != 1:
+            print(handle_ecode(Ecode.EMPTY_ARGUMENT))
+            return
+
+        result = self.diff(args[0], progress=print_progress, **options)
+        print(handle_ecode(result) if isinstance(result, Ecode) else format_diff(result))
+
+    def do_stats(self, arg: str) -> None:
+        """stats [on | off | reset | json [PATH]]: show per-command protocol statistics.
+
+        Profiling is disabled by default, `stats on` starts collecting latency, traffic, XON stall time and
+        echo mismatches of every command, `stats json` prints them as JSON or saves them to PATH.
+        """
+        args = arg.split()
+        action = args[0] if args else 'show'
+        if action == 'on':
+            self.enable_stats()
+            print('Protocol profiling enabled.')
+        elif action == 'off':
+            self.disable_stats()
+            print('Protocol profiling disabled.')
+        elif self.stats is None:
+            print('Protocol profiling is disabled, enable it with `stats on`.')
+        elif action == 'reset':
+            self.stats.reset()
+            print('Protocol statistics cleared.')
+        elif action == 'json' and len(args) > 1:
+            try:
+                with open(args[1], 'w') as file:
+                    file.write(self.stats.to_json())
+            except Exception as ex:
+                logger.error(f'Saving statistics failed: {ex}.')
+                print(handle_ecode(Ecode.SAVING_FILE_ERROR))
+            else:
+                print(f'Protocol statistics saved to {args[1]}.')
+        elif action == 'json':
+            print(self.stats.to_json())
+        elif action == 'show':
+            print(format_stats(self.stats.to_dict()))
+        else:
+            print(handle_ecode(Ecode.PROCESSING_ARGUMENT_FAILED))
+
+    def do_shadow(self, arg: str) -> None:
+        """shadow [on | off]: keep memory read back from the chip and serve reads and checksums from it.
+
+        The shadow copy is disabled by default, enable it only while the same chip stays in the panel, since
+        programmer cannot tell a swapped chip of the same kind.
+        """
+        action = arg.strip() or 'show'
+        if action == 'on':
+            self.enable_shadow()
+            print('Shadow copy enabled.')
+        elif action == 'off':
+            self.disable_shadow()
+            print('Shadow copy disabled.')
+        elif action == 'show':
+            state = 'enabled' if self._shadow.enabled else 'disabled'
+            print(f'Shadow copy is {state}, it holds {self._shadow.known} bytes of chip memory.')
+        else:
+            print(handle_ecode(Ecode.PROCESSING_ARGUMENT_FAILED))
+
+    def do_gang_write(self, arg: str) -> None:
+        """gang_write <device>... <path> [--burst WINDOW] [--if-changed] [--full-verify]: write image with
+        several programmers concurrently, devices may be glob patterns like /dev/ttyUSB*.
+
+        Gang commands connect with --baudrate RATE, --timeout SECONDS and --probe like `connect`.
+        """
+        parsed = parse_options(arg, {'burst': int, 'if_changed': bool, 'full_verify': bool, **CONNECT_OPTIONS})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if len(args) < 2:
+            print(handle_ecode(Ecode.EMPTY_ARGUMENT))
+            return
+
+        window = options.pop('burst', 0)
+        connect = self._connect_options(options)
+        self._run_gang(args[:-1], connect, lambda gang: gang.write(args[-1], report=print_gang_progress,
+                                                                   window=window, **options))
+
+    def do_gang_verify(self, arg: str) -> None:
+        """gang_verify <device>... <path> [--full]: verify image with several programmers concurrently."""
+        parsed = parse_options(arg, {'full': bool, **CONNECT_OPTIONS})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if len(args) < 2:
+            print(handle_ecode(Ecode.EMPTY_ARGUMENT))
+            return
+
+        connect = self._connect_options(options)
+        self._run_gang(args[:-1], connect, lambda gang: gang.verify(args[-1], report=print_gang_progress, **options))
+
+    def do_gang_read(self, arg: str) -> None:
+        """gang_read <device>... <path> [--occupied | --start ADDRESS --length LENGTH] [--min-padding N]: read chips
+        with several programmers concurrently, {device} in path is replaced with device name, like dump_{device}.hex.
+        """
+        parsed = parse_options(arg, {'occupied': bool, 'start': parse_address, 'length': parse_address,
+                                     'min_padding': int, **CONNECT_OPTIONS})
+        if isinstance(parsed, Ecode):
+            print(handle_ecode(parsed))
+            return
+        args, options = parsed
+        if len(args) < 2:
+            print(handle_ecode(Ecode.EMPTY_ARGUMENT))
+            return
+
+        connect = self._connect_options(options)
+        self._run_gang(args[:-1], connect, lambda gang: gang.read(args[-1], report=print_gang_progress, **options))
+
+    def do_bg(self, arg: str) -> None:
+        """bg <command> [arguments]: run programmer command, like write, read or verify, in background.
+
+        Jobs run one after another, `jobs` shows their progress, `wait` follows them and `cancel` stops them.
+        Other programmer commands are refused until the jobs finish.
+        """
+        from flashloader.batch import STEPS, parse_step
+
+        step = parse_step(arg)
+        if isinstance(step, Ecode):
+            print(handle_ecode(step))
+            return
+        method = getattr(self, STEPS[step.pop('command')][0])
+        if 'progress' in inspect.signature(method).parameters:
+            job = self.jobs.submit(arg, lambda progress: method(progress=progress, **step))
+        else:
+            job = self.jobs.submit(arg, lambda progress: method(**step))
+        print(f'[{job.number}] {arg}')
+
+    def do_jobs(self, _) -> None:
+        """jobs: list background jobs with progress and estimated time of running transfer."""
+        jobs = self.jobs.jobs
+        print('\n'.join(job.describe() for job in jobs) if jobs else 'No background jobs.')
+
+    def do_wait(self, arg: str) -> None:
+        """wait [JOB]: follow progress of the job, or of all unfinished jobs, until they finish.
+
+        Ctrl-C stops waiting, jobs keep running.
+        """
+        jobs = self._select_jobs(arg)
+        try:
+            for job in jobs or []:
+                while not job.finished.wait(WAIT_REFRESH):
+                    print(f'\r{job.describe()}\033[K', end='', flush=True)
+                print(f'\r{job.describe()}\033[K')
+        except KeyboardInterrupt:
+            print('\nStopped waiting, jobs keep running.')
+
+    def do_cancel(self, arg: str) -> None:
+        """cancel [JOB]: cancel the job, or all unfinished jobs, programmer is resynchronised afterwards."""
+        jobs = self._select_jobs(arg)
+        if jobs is None:
+            return
+        for job in jobs:
+            self.jobs.cancel(job)
+            print(f'[{job.number}] cancelling: {job.line}')
+
+    def _select_jobs(self, arg: str) -> Optional[List[Job]]:
+        if not arg.strip():
+            return [job for job in self.jobs.jobs if not job.finished.is_set()]
+        number = parse_arg(arg, expected_type=int)
+        job = self.jobs.find(number) if not isinstance(number, Ecode) else None
+        if job is None:
+            print(f'No such job: {arg.strip()}.')
+            return None
+        return [job]
+
     @staticmethod
-    def do_exit(_):
+    def _connect_options(options: dict) -> dict:
+        """Move connect options out of options of a gang command."""
+        return {name: options.pop(name) for name in CONNECT_OPTIONS if name in options}
+
+    @staticmethod
+    def _run_gang(patterns, connect: dict, action) -> None:
+        from flashloader.ezdl import GangFlasher
+
+        gang = GangFlasher(expand_devices(patterns))
+        connected = gang.connect(**connect)
+        results = action(gang)
+        gang.disconnect()
+        print()
+        for device in gang.devices:
+            ecode = connected[device] if connected[device] != Ecode.OK else results[device]
+            print(f'{device}: {handle_ecode(ecode)}')
+
+    def do_exit(self, _):
         """Stop recording, close the flasher window, and exit."""
+        for job in self.jobs.cancel():
+            job.finished.wait()
         print('Thank you for using flashtool.')
         return True
 
@@ -123,6 +451,10 @@ class FlasherCLI(EZDLFlasher, Cmd):
     def complete_connect(text, line, startidx, endidx):
         return path_completion(text, line, startidx, endidx)
 
+    @staticmethod
+    def complete_scan(text, line, startidx, endidx):
+        return path_completion(text, line, startidx, endidx)
+
     @staticmethod
     def complete_write(text, line, startidx, endidx):
         return path_completion(text, line, startidx, endidx)
@@ -134,3 +466,15 @@ class FlasherCLI(EZDLFlasher, Cmd):
     @staticmethod
     def complete_verify(text, line, startidx, endidx):
         return path_completion(text, line, startidx, endidx)
+
+    @staticmethod
+    def complete_gang_write(text, line, startidx, endidx):
+        return path_completion(text, line, startidx, endidx)
+
+    @staticmethod
+    def complete_gang_verify(text, line, startidx, endidx):
+        return path_completion(text, line, startidx, endidx)
+
+    @staticmethod
+    def complete_gang_read(text, line, startidx, endidx):
+        return path_completion(text, line, startidx, endidx)
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, List, Optional
+
+from flashloader.constants import Ecode
+from flashloader.ezdl import EZDLFlasher
+from flashloader.ezdl.utils import OperationCancelled, ProgressCallback
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+CANCELLING = 'cancelling'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    return f'{minutes}:{seconds:02d}'
+
+
+class Job:
+    """Shell command running in background, with progress of its current transfer."""
+
+    def __init__(self, number: int, line: str, action: Callable[[ProgressCallback], Any]):
+        self.number = number
+        self.line = line
+        self.action = action
+        self.state = QUEUED
+        self.result: Any = None
+        self.done = 0
+        self.total = 0
+        self.finished = threading.Event()
+        self.reported = False
+        self._transfer_start: Optional[float] = None
+
+    def progress(self, done: int, total: int) -> None:
+        # Every transfer of the job (upload, verification readback, retry) starts counting again.
+        if self._transfer_start is None or done < self.done or total != self.total:
+            self._transfer_start = time.monotonic()
+        self.done, self.total = done, total
+
+    @property
+    def eta(self) -> Optional[float]:
+        if self._transfer_start is None or not self.done:
+            return None
+        elapsed = time.monotonic() - self._transfer_start
+        return (self.total - self.done) * elapsed / self.done
+
+    def describe(self) -> str:
+        text = f'[{self.number}] {self.state:<10} {self.line}'
+        if self.state == RUNNING and self.total:
+            text += f'  {self.done}/{self.total} bytes ({100 * self.done // self.total}%)'
+            eta = self.eta
+            if eta is not None:
+                text += f', ETA {format_duration(eta)}'
+        return text
+
+
+class JobManager:
+    """Background jobs of one flasher, run one after another by a worker thread.
+
+    The programmer serves one transaction at a time, so jobs are queued rather than run in parallel.
+    """
+
+    def __init__(self, flasher: EZDLFlasher):
+        self._flasher = flasher
+        self._jobs: List[Job] = []
+        self._queue: Deque[Job] = deque()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs)
+
+    @property
+    def busy(self) -> bool:
+        with self._lock:
+            return any(not job.finished.is_set() for job in self._jobs)
+
+    def find(self, number: int) -> Optional[Job]:
+        return next((job for job in self.jobs if job.number == number), None)
+
+    def submit(self, line: str, action: Callable[[ProgressCallback], Any]) -> Job:
+        with self._lock:
+            job = Job(len(self._jobs) + 1, line, action)
+            self._jobs.append(job)
+            self._queue.append(job)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name='flasher-jobs', daemon=True)
+                self._worker.start()
+        return job
+
+    def cancel(self, job: Optional[Job] = None) -> List[Job]:
+        """Cancel the job or all unfinished jobs, returns the jobs which were queued or running."""
+        cancelled = []
+        with self._lock:
+            for item in self._jobs if job is None else [job]:
+                if item.state == QUEUED:
+                    self._queue.remove(item)
+                    item.state = CANCELLED
+                    item.finished.set()
+                elif item.state == RUNNING:
+                    item.state = CANCELLING
+                    self._flasher.cancel()
+                else:
+                    continue
+                cancelled.append(item)
+        return cancelled
+
+    def unreported(self) -> List[Job]:
+        """Finished jobs whose results were not shown yet."""
+        with self._lock:
+            jobs = [job for job in self._jobs if job.finished.is_set() and not job.reported]
+            for job in jobs:
+                job.reported = True
+        return jobs
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._worker = None
+                    return
+                job = self._queue.popleft()
+                job.state = RUNNING
+                self._flasher.reset_cancel()
+
+            # Messages of the flasher would break into the shell prompt, results are reported by the shell.
+            verbose, self._flasher.verbose = self._flasher.verbose, False
+            try:
+                result = job.action(job.progress)
+            except OperationCancelled:
+                result, state = None, CANCELLED
+            except Exception as ex:
+                logger.error(f'Job {job.line} failed: {ex}.')
+                result, state = Ecode.UNEXPECTED_ERROR, FAILED
+            else:
+                state = FAILED if isinstance(result, Ecode) and result != Ecode.OK else DONE
+            finally:
+                self._flasher.verbose = verbose
+
+            with self._lock:
+                # Cancel requested after the last transaction of the job must not stop the next command.
+                self._flasher.reset_cancel()
+                job.result, job.state = result, state
+                job.finished.set()
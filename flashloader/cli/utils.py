@@ -2,9 +2,11 @@ import glob
 import logging
 import os
 import shlex
-from typing import List, Union
+from typing import Any, Dict, Iterable, List, Tuple, Union
 
 from flashloader.constants import Ecode
+from flashloader.ezdl import PortScanResult, VerifyDiff
+from flashloader.hex_processing import format_ranges
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +48,102 @@ def parse_arg(arg: str, expected_type: type = str) -> Union[str, int, float, Eco
         return arg
 
 
+def parse_options(arg: str, options: Dict[str, type]) -> Union[Tuple[List[str], Dict[str, Any]], Ecode]:
+    """Split argument string to positional arguments and `--name [value]` options.
+
+    Options with bool type are switches and take no value, other types are used to convert option value.
+    """
+    try:
+        tokens = shlex.split(arg)
+    except Exception as ex:
+        logger.error(f'Error processing input argument: {ex}.')
+        return Ecode.PROCESSING_ARGUMENT_FAILED
+
+    positional, parsed = [], {}
+    tokens = iter(tokens)
+    for token in tokens:
+        if not token.startswith('--'):
+            positional.append(token)
+            continue
+
+        name = token[2:].replace('-', '_')
+        if name not in options:
+            logger.error(f'Unknown option: {token}.')
+            return Ecode.PROCESSING_ARGUMENT_FAILED
+        if options[name] is bool:
+            parsed[name] = True
+            continue
+
+        try:
+            parsed[name] = options[name](next(tokens))
+        except Exception as ex:
+            logger.error(f'Error processing option {token}: {ex!r}.')
+            return Ecode.PROCESSING_ARGUMENT_FAILED
+    return positional, parsed
+
+
+def parse_address(value: str) -> int:
+    """Integer in decimal or prefixed (0x, 0o, 0b) notation."""
+    return int(value, 0)
+
+
+def print_progress(done: int, total: int) -> None:
+    print(f'\r{done}/{total} bytes ({100 * done // max(total, 1)}%)', end='' if done < total else '\n', flush=True)
+
+
+def print_gang_progress(progress: Dict[str, Tuple[int, int]]) -> None:
+    states = [f'{os.path.basename(device)} {100 * done // total if total else 0}%'
+              for device, (done, total) in progress.items()]
+    print('\r' + ' | '.join(states), end='', flush=True)
+
+
+def expand_devices(patterns: Iterable[str]) -> List[str]:
+    """Device paths matching glob patterns, patterns without matches are kept as is."""
+    devices = []
+    for pattern in patterns:
+        for device in sorted(glob.glob(pattern)) or [pattern]:
+            if device not in devices:
+                devices.append(device)
+    return devices
+
+
+def format_stats(stats: Dict[str, Dict[str, Any]]) -> str:
+    lines = [f'{"command":<16}{"count":>7}{"total, s":>10}{"mean, s":>10}{"max, s":>10}{"sent":>8}{"received":>10}'
+             f'{"xon stall, s":>14}{"mismatches":>12}']
+    for command, item in stats.items():
+        lines.append(f'{command:<16}{item["count"]:>7}{item["total_time"]:>10.3f}{item["mean_time"]:>10.4f}'
+                     f'{item["max_time"]:>10.3f}{item["bytes_sent"]:>8}{item["bytes_received"]:>10}'
+                     f'{item["xon_stall"]:>14.3f}{item["echo_mismatches"]:>12}')
+    return '\n'.join(lines)
+
+
+def format_scan(results: List[PortScanResult]) -> str:
+    lines = [f'{"device":<20}{"baud":>8}  {"programmer":<40}{"chip":<8}{"voltage":>8}{"non blank":>11}']
+    for result in results:
+        baudrate = result.baudrate or '-'
+        title = result.title or handle_ecode(result.error)
+        chip = result.chip
+        if chip is not None:
+            lines.append(f'{result.device:<20}{baudrate:>8}  {title:<40}{chip.mcu.value:<8}'
+                         f'{chip.prog_voltage_type.value:>8}{chip.non_blank_bytes:>11}')
+        else:
+            state = handle_ecode(result.error) if result.has_programmer else ''
+            lines.append(f'{result.device:<20}{baudrate:>8}  {title:<40}{state}')
+    return '\n'.join(lines)
+
+
+def format_diff(diff: VerifyDiff) -> str:
+    if diff.ok:
+        return f'Chip memory matches the image, {diff.length} bytes compared.'
+    lines = [f'{diff.mismatched} of {diff.length} bytes differ in {len(diff.ranges)} ranges: '
+             f'{format_ranges(diff.ranges)}.']
+    if diff.transient:
+        lines.append('Read again without differences, the first readback was garbled by the transfer.')
+    elif diff.rechecked:
+        lines.append(f'Read again with the same differences in {format_ranges(diff.persistent)}.')
+    return '\n'.join(lines)
+
+
 def handle_ecode(ecode: Ecode) -> str:
     if isinstance(ecode, Ecode):
         return str(ecode.value)
@@ -5,6 +5,7 @@ class Ecode(str, Enum):
     OK = 'Command completed successfully.'
     FILE_NOT_EXIST = 'Invalid file path, file not exist.'
     SAVING_FILE_ERROR = 'Saving file failed.'
+    LOADING_FILE_ERROR = 'Loading file failed.'
     EMPTY_ARGUMENT = 'Argument expected but not passed.'
     PROCESSING_ARGUMENT_FAILED = 'Error processing input argument.'
     PROGRAMMER_DISCONNECTED = 'Programmer is not connected.'
@@ -17,6 +18,7 @@ class Ecode(str, Enum):
     ERASING_FAILED = 'Erasing chip memory failed'
     WRITING_FAILED = 'Writing hex file to chip memory failed.'
     READING_FAILED = 'Reading chip memory finished with error.'
+    INVALID_MEMORY_RANGE = 'Requested memory range is out of chip memory.'
     VERIFICATION_FAILED = 'Verification finished with error.'
     GETTING_CHECKSUM_FAILED = 'Error getting checksum from chip.'
     GETTING_PGM_DATA_FAILED = 'Error getting pgm data from chip.'
@@ -27,6 +29,7 @@ class Ecode(str, Enum):
     GENERATE_INFO_MESSAGE_FAILED = 'Error parse chip information message from programmer.'
     UNKNOWN_CHIP = 'Failed to recognize the chip.'
     CHIP_NOT_FOUND = 'Chip not found.'
+    UNEXPECTED_ERROR = 'Operation failed with unexpected error.'
 
 
 class ProgVoltages(str, Enum):
@@ -45,3 +48,6 @@ MCUMemorySize = {
     SupportedMCU.AT89C52: 8192,
     SupportedMCU.AT89C55: 20480,
 }
+
+DEFAULT_BAUDRATE = 9600
+PROBE_BAUDRATES = (115200, 57600, 38400, 19200, 9600)
@@ -0,0 +1,303 @@
+"""Local daemon owning flasher sessions, so several shells and CI jobs share warm programmer connections.
+
+Clients talk JSON-RPC 2.0 over a Unix socket, one JSON object per line. Methods are the batch steps
+(connect, info, write, read, verify, ...) taking the port as `device` parameter, plus `sessions` and
+`shutdown`. Requests for one port are queued and served in arrival order, ports work in parallel:
+
+    {"jsonrpc": "2.0", "id": 1, "method": "write", "params": {"device": "/dev/ttyUSB0", "path": "/abs/fw.hex"}}
+
+Step results have the batch report form, failed steps are results with `ok` false, JSON-RPC errors are left
+for malformed requests.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from .batch import STEPS, BatchRunner, Step
+from .constants import Ecode
+from .ezdl import EZDLFlasher
+
+logger = logging.getLogger(__name__)
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+# Step parameters holding file paths, made absolute by clients since the daemon runs in its own directory.
+PATH_PARAMS = ('path',)
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'flashloader.sock')
+    return os.path.join(tempfile.gettempdir(), f'flashloader-{os.getuid()}.sock')
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class DeviceSession:
+    """Flasher of one port with the queue of its requests, served one after another by a single thread."""
+
+    def __init__(self, device: str):
+        self.device = device
+        self.runner = BatchRunner(EZDLFlasher(verbose=False))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'flasher {device}')
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, step: Step) -> 'Future[Dict[str, Any]]':
+        with self._lock:
+            self.pending += 1
+        return self._executor.submit(self._run, step)
+
+    def _run(self, step: Step) -> Dict[str, Any]:
+        try:
+            return self.runner.run_step(step)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def describe(self) -> Dict[str, Any]:
+        flasher = self.runner.flasher
+        return {'device': self.device, 'connected': flasher.device is not None, 'baudrate': flasher.baudrate,
+                'pending': self.pending}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        if self.runner.flasher.device is not None:
+            self.runner.flasher.disconnect()
+
+
+class FlasherDaemon:
+    """JSON-RPC dispatcher over the sessions of all ports, independent of the transport."""
+
+    def __init__(self):
+        self._sessions: Dict[str, DeviceSession] = {}
+        self._lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def session(self, device: str) -> DeviceSession:
+        with self._lock:
+            if device not in self._sessions:
+                self._sessions[device] = DeviceSession(device)
+            return self._sessions[device]
+
+    def handle(self, request: Any) -> Optional[Dict[str, Any]]:
+        """Response to decoded request, None for notification."""
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' \
+                    or not isinstance(request.get('method'), str):
+                raise RPCError(INVALID_REQUEST, 'Invalid request')
+            result = self.call(request['method'], request.get('params', {}))
+        except RPCError as ex:
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': ex.code, 'message': ex.message}}
+        if 'id' not in request:
+            return None
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    def call(self, method: str, params: Any) -> Any:
+        if method == 'sessions':
+            with self._lock:
+                return [session.describe() for session in self._sessions.values()]
+        if method == 'shutdown':
+            self.stopped.set()
+            return True
+        if method not in STEPS:
+            raise RPCError(METHOD_NOT_FOUND, f'Unknown method: {method}')
+        if not isinstance(params, dict) or not isinstance(params.get('device'), str):
+            raise RPCError(INVALID_PARAMS, 'Params must be an object with device')
+
+        step = {key: value for key, value in params.items() if key != 'device' or method == 'connect'}
+        _, positional, options = STEPS[method]
+        missing = set(positional) - set(step)
+        unknown = set(step) - set(positional) - set(options)
+        if missing or unknown:
+            raise RPCError(INVALID_PARAMS, f'Missing params: {", ".join(sorted(missing)) or "none"}, '
+                                           f'unknown params: {", ".join(sorted(unknown)) or "none"}')
+        step['command'] = method
+        logger.info(f'{params["device"]}: {method} {step}.')
+        return self.session(params['device']).submit(step).result()
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: '_Server'
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'jsonrpc': '2.0', 'id': None, 'error': {'code': PARSE_ERROR, 'message': 'Parse error'}}
+            else:
+                response = self.server.service.handle(request)
+            if response is not None:
+                self.wfile.write(json.dumps(response).encode() + b'\n')
+                self.wfile.flush()
+            if self.server.service.stopped.is_set():
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, service: FlasherDaemon):
+        self.service = service
+        super().__init__(path, _RequestHandler)
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Remove socket left by crashed daemon, refuse to replace running one."""
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+        else:
+            raise RuntimeError(f'Daemon is already running on {path}')
+
+
+def serve(path: Optional[str] = None) -> Ecode:
+    """Serve requests on Unix socket until `shutdown` request or interrupt."""
+    path = path or default_socket_path()
+    daemon = FlasherDaemon()
+    try:
+        _remove_stale_socket(path)
+        server = _Server(path, daemon)
+        os.chmod(path, 0o600)
+    except Exception as ex:
+        logger.error(f'Starting daemon on {path} failed: {ex}.')
+        return Ecode.CONNECTION_ERROR
+
+    logger.info(f'Daemon listening on {path}.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if os.path.exists(path):
+            os.unlink(path)
+    return Ecode.OK
+
+
+class DaemonError(RuntimeError):
+    def __init__(self, code: int, message: str):
+        super().__init__(f'{message} ({code})')
+        self.code = code
+
+
+class DaemonClient:
+    """Blocking JSON-RPC client of the daemon, one connection reused for all calls."""
+
+    def __init__(self, path: Optional[str] = None, timeout: Optional[float] = None):
+        self.path = path or default_socket_path()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(self.path)
+        self._file = self._socket.makefile('rwb')
+        self._next_id = 0
+
+    def call(self, method: str, **params) -> Any:
+        self._next_id += 1
+        for key in PATH_PARAMS:
+            if isinstance(params.get(key), str):
+                params[key] = os.path.abspath(params[key])
+        request = {'jsonrpc': '2.0', 'id': self._next_id, 'method': method, 'params': params}
+        self._file.write(json.dumps(request).encode() + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise DaemonError(INVALID_REQUEST, 'Daemon closed connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise DaemonError(response['error']['code'], response['error']['message'])
+        return response['result']
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self) -> 'DaemonClient':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def failed_step(command: str, ecode: Ecode, detail: str = '') -> Dict[str, Any]:
+    """Report of step which did not reach the flasher, in the form of BatchRunner results."""
+    message = f'{ecode.value} {detail}' if detail else ecode.value
+    return {'command': command, 'ok': False, 'ecode': ecode.name, 'message': message, 'result': None, 'seconds': 0.0}
+
+
+class DaemonRunner:
+    """Batch runner sending steps to the daemon, the port is the one of the last connect step.
+
+    Sessions stay connected after the run for the next client.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+
+    def run(self, steps: List[Step], stop_on_error: bool = True) -> Dict[str, Any]:
+        results, device = [], None
+        with DaemonClient(self.path) as client:
+            for step in steps:
+                params = {key: value for key, value in step.items() if key != 'command'}
+                if step['command'] == 'connect':
+                    device = params['device']
+                if device is None:
+                    result = failed_step(step['command'], Ecode.PROGRAMMER_DISCONNECTED)
+                else:
+                    params['device'] = device
+                    try:
+                        result = client.call(step['command'], **params)
+                    except DaemonError as ex:
+                        result = failed_step(step['command'], Ecode.PROCESSING_ARGUMENT_FAILED, str(ex))
+                results.append(result)
+                if stop_on_error and not result['ok']:
+                    break
+        ok = len(results) == len(steps) and all(result['ok'] for result in results)
+        return {'ok': ok, 'steps': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='flashloader-daemon', description='Serve flasher sessions of all ports '
+                                     'over Unix socket, keeping programmer connections open between clients.')
+    parser.add_argument('-s', '--socket', help=f'socket path, {default_socket_path()} by default')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log requests and errors of steps')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    sys.exit(0 if serve(args.socket) == Ecode.OK else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,19 @@
 # flake8: noqa
+import importlib
+
 from .easy_downloader import EZDLFlasher
 from .enums import ActionSignals, Commands
-from .messages import InfoMessage, PGMMessage
+from .messages import InfoMessage, PGMMessage, PortScanResult, VerifyDiff, WritePlan
+
+# Imported on first access, the shell does not need asyncio or port enumeration to start.
+_LAZY = {
+    'AsyncEZDLFlasher': '.aio',
+    'GangFlasher': '.gang',
+    'scan': '.discovery',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,522 @@
+import asyncio
+import logging
+import os
+from typing import Optional, Union
+
+import serial
+
+from flashloader.constants import DEFAULT_BAUDRATE, Ecode
+from flashloader.hex_processing import PADDING_RUN, FirmwareImage, save_image
+from flashloader.image_cache import as_image
+
+from .decorators import async_check_chip, async_check_programmer
+from .easy_downloader import RESYNC_ATTEMPTS, RESYNC_QUIET
+from .enums import Commands
+from .messages import InfoMessage, PGMMessage, WritePlan
+from .session import SessionState
+from .utils import (HANDSHAKE_PAIR, READ_CHUNK_SIZE, DesyncError, HexDumpDecoder, PaddingFeed, ProgressCallback,
+                    check_allow, check_echo, check_handshake, check_single_byte, convert_counter, drain_target,
+                    fit_image, is_valid_title, padding_pending, parse_checksum, parse_info, parse_pgm, parse_response,
+                    parse_title, plan_write, read_end)
+
+logger = logging.getLogger('ezdl_async_flasher')
+
+ASYNC_TIMEOUT = 5.0
+
+
+class AsyncSerial:
+    """Serial port in non-blocking mode driven by event loop readiness callbacks, POSIX only.
+
+    `timeout` limits waiting for every next chunk of data, not the whole operation.
+    """
+
+    def __init__(self, dev: serial.Serial, timeout: Optional[float] = ASYNC_TIMEOUT):
+        self._dev = dev
+        self._received = bytearray()
+        self.timeout = timeout
+
+    @classmethod
+    def open(cls, device: str, baudrate: int = DEFAULT_BAUDRATE,
+             timeout: Optional[float] = ASYNC_TIMEOUT) -> 'AsyncSerial':
+        return cls(serial.Serial(device, baudrate, timeout=0, write_timeout=0), timeout)
+
+    @property
+    def name(self) -> str:
+        return self._dev.name
+
+    @property
+    def is_open(self) -> bool:
+        return self._dev.is_open
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._received) + self._dev.in_waiting
+
+    def close(self) -> None:
+        self._dev.close()
+
+    def reset_buffers(self) -> None:
+        self._received.clear()
+        self._dev.reset_input_buffer()
+        self._dev.reset_output_buffer()
+
+    async def _wait(self, writable: bool = False) -> None:
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = self._dev.fileno()
+
+        def on_ready() -> None:
+            if not ready.done():
+                ready.set_result(None)
+
+        add, remove = (loop.add_writer, loop.remove_writer) if writable else (loop.add_reader, loop.remove_reader)
+        add(fd, on_ready)
+        try:
+            await asyncio.wait_for(ready, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'No response from {self.name} in {self.timeout} s') from None
+        finally:
+            remove(fd)
+
+    async def _receive(self) -> None:
+        while True:
+            data = self._dev.read(max(1, self._dev.in_waiting))
+            if data:
+                self._received += data
+                return
+            await self._wait()
+
+    async def read(self, size: int = 1) -> bytes:
+        while len(self._received) < size:
+            await self._receive()
+        data = bytes(self._received[:size])
+        del self._received[:size]
+        return data
+
+    async def read_some(self, size: int) -> bytes:
+        if not self._received:
+            await self._receive()
+        return await self.read(min(size, len(self._received)))
+
+    async def read_until(self, expected: bytes) -> bytes:
+        while expected not in self._received:
+            await self._receive()
+        return await self.read(self._received.index(expected) + len(expected))
+
+    async def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self._dev.fileno(), view):]
+            except BlockingIOError:
+                await self._wait(writable=True)
+
+
+async def send_command(port: AsyncSerial, command: Commands) -> None:
+    if not isinstance(command, Commands):
+        raise ValueError(f'Expected single byte command, recieved: {command}')
+
+    port.reset_buffers()
+    await send_byte(port, command, False)
+
+
+async def send_data(port: AsyncSerial, command: Commands, data: bytes = None, action_check: bool = False,
+                    window: int = 0, progress: Optional[ProgressCallback] = None,
+                    sent: Optional[ProgressCallback] = None) -> str:
+    await send_command(port, command)
+
+    if data and action_check and window > 0:
+        await send_burst(port, data, window, progress, sent)
+    elif data:
+        for idx in range(len(data)):
+            await wait_allow_byte(port)
+            if sent is not None:
+                sent(idx + 1, len(data))
+            await send_byte(port, bytes(data[idx:idx+1]), action_check)
+            if progress is not None:
+                progress(idx + 1, len(data))
+
+    return parse_response(command, await port.read_until(b'>'))
+
+
+async def send_byte(port: AsyncSerial, byte: bytes, action_check: bool) -> None:
+    check_single_byte(byte)
+    await port.write(byte)
+    check_echo(port, byte, action_check, await port.read(1))
+
+
+async def wait_allow_byte(port: AsyncSerial) -> None:
+    check_allow(port, await port.read(1))
+
+
+async def send_burst(port: AsyncSerial, data: bytes, window: int, progress: Optional[ProgressCallback] = None,
+                     sent: Optional[ProgressCallback] = None) -> None:
+    view = memoryview(data)
+    drained = 0
+    for offset in range(0, len(view), window):
+        end = min(offset + window, len(view))
+        if sent is not None:
+            sent(end, len(view))
+        await port.write(view[offset:end])
+        drained = await drain_handshake(port, drained, drain_target(drained, port.in_waiting, end, window))
+        if progress is not None:
+            progress(drained, len(view))
+    await drain_handshake(port, drained, len(view))
+    if progress is not None:
+        progress(len(view), len(view))
+
+
+async def drain_handshake(port: AsyncSerial, drained: int, until: int) -> int:
+    if until <= drained:
+        return drained
+
+    check_handshake(port, await port.read(len(HANDSHAKE_PAIR) * (until - drained)), drained, until - drained)
+    return until
+
+
+async def read_firmware(port: AsyncSerial, length: int, progress: Optional[ProgressCallback] = None) -> bytearray:
+    await send_command(port, Commands.READ_FIRMWARE)
+
+    decoder = HexDumpDecoder(length)
+    while not decoder.finished:
+        decoder.feed(await port.read_some(READ_CHUNK_SIZE))
+        if progress is not None:
+            progress(decoder.decoded, length)
+    decoder.check()
+    return decoder.buffer
+
+
+class AsyncEZDLFlasher:
+    """Coroutine counterpart of EZDLFlasher, one event loop can drive many programmers.
+
+    Public methods of one flasher are serialized by a lock. Waiting for programmer response longer than
+    `timeout` fails the operation, any operation can be cancelled. A failed or cancelled transaction brings
+    the programmer back to the command prompt before the lock is released, so the next call finds it in step.
+    """
+
+    def __init__(self, timeout: Optional[float] = ASYNC_TIMEOUT, verbose: bool = False):
+        self.timeout = timeout
+        self.verbose = verbose
+        self._port: Optional[AsyncSerial] = None
+        self._session = SessionState()
+        self._guard: Optional[asyncio.Lock] = None
+
+    @property
+    def _lock(self) -> asyncio.Lock:
+        # Created on first use to bind the lock to the running event loop.
+        if self._guard is None:
+            self._guard = asyncio.Lock()
+        return self._guard
+
+    def _echo(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+
+    async def _send(self, command: Commands, data: bytes = None, **kwargs) -> str:
+        written = 0
+
+        def track(done: int, total: int) -> None:
+            nonlocal written
+            written = done
+
+        try:
+            return await send_data(self._port, command, data, sent=track, **kwargs)
+        except (asyncio.CancelledError, TimeoutError, DesyncError) as ex:
+            # Failed GET_TITLE is the probe of resynchronisation itself, a silent port is not probed again.
+            if command != Commands.GET_TITLE or isinstance(ex, asyncio.CancelledError):
+                await self._resync(padding_pending(command, len(data) - written if data else 0))
+            raise
+
+    async def _resync(self, pending: int = 0) -> bool:
+        """Same steps as EZDLFlasher._resync, after failed or cancelled transaction as well."""
+        self._session.clear()
+        feed = PaddingFeed(pending)
+        try:
+            while feed.pending > 0:
+                accepted = feed.accept(await self._listen(1))
+                if accepted is None:
+                    break
+                if not accepted:
+                    continue
+                await self._port.write(PaddingFeed.BYTE)
+                if not feed.acknowledged(await self._listen(1)):
+                    break
+            for _ in range(RESYNC_ATTEMPTS):
+                while await self._listen(READ_CHUNK_SIZE):
+                    pass
+                try:
+                    title = parse_title(await send_data(self._port, Commands.GET_TITLE))
+                except (TimeoutError, DesyncError):
+                    continue
+                if is_valid_title(title):
+                    logger.info('Programmer resynchronised.')
+                    return True
+        except Exception as ex:
+            logger.error(f'Resynchronising programmer failed: {ex}.')
+        return False
+
+    async def _listen(self, size: int) -> bytes:
+        """Up to `size` bytes received in RESYNC_QUIET, empty when the programmer stays silent."""
+        timeout, self._port.timeout = self._port.timeout, RESYNC_QUIET
+        try:
+            return await self._port.read_some(size)
+        except TimeoutError:
+            return b''
+        finally:
+            self._port.timeout = timeout
+
+    async def _is_connected(self, refresh: bool = False) -> bool:
+        try:
+            if self._port is None or not self._port.is_open:
+                return False
+            elif not refresh and self._session.title is not None:
+                return True
+            elif isinstance(await self._get_programmer_title(), Ecode):
+                self._disconnect()
+                return False
+            else:
+                return True
+        except Exception as ex:
+            logger.error(f'Error get connection state: {ex}.')
+            return False
+
+    @property
+    def device(self) -> Optional[str]:
+        return self._port.name if self._port is not None else None
+
+    async def connect(self, device: str, baudrate: int = DEFAULT_BAUDRATE) -> Ecode:
+        async with self._lock:
+            if await self._is_connected():
+                logger.info('Programmer is already connected.')
+                return Ecode.OK
+
+            try:
+                self._port = AsyncSerial.open(device, baudrate, self.timeout)
+            except Exception as ex:
+                logger.error(f'Open programmer on {device} failed: {ex}.')
+                return Ecode.CONNECTION_ERROR
+
+            self._session.clear()
+            return Ecode.OK if await self._is_connected(refresh=True) else Ecode.PROGRAMMER_NOT_FOUND
+
+    async def disconnect(self) -> Ecode:
+        async with self._lock:
+            if self._port is None:
+                return Ecode.OK
+            return self._disconnect()
+
+    def _disconnect(self) -> Ecode:
+        try:
+            self._port.close()
+        except Exception as ex:
+            logger.error(f'Disconnect programmer failed, clearing device variable, error: {ex}.')
+            return Ecode.DISCONNECTION_ERROR
+        else:
+            return Ecode.OK
+        finally:
+            self._port = None
+            self._session.clear()
+
+    async def refresh(self) -> Ecode:
+        async with self._lock:
+            self._session.clear()
+            if not await self._is_connected(refresh=True):
+                return Ecode.PROGRAMMER_DISCONNECTED
+            info = await self._chip_info(refresh=True)
+            return Ecode.OK if isinstance(info, InfoMessage) else info
+
+    @async_check_programmer
+    async def get_title(self) -> Union[str, Ecode]:
+        return await self._get_programmer_title()
+
+    async def _get_programmer_title(self) -> Union[str, Ecode]:
+        try:
+            response = await self._send(Commands.GET_TITLE)
+        except Exception as ex:
+            logger.error(f'Error getting programmer title: {ex}.')
+            return Ecode.GETTING_TITLE_FAILED
+        else:
+            self._session.title = parse_title(response)
+            return self._session.title
+
+    @async_check_programmer
+    async def get_info(self) -> Union[InfoMessage, Ecode]:
+        return await self._chip_info(refresh=True)
+
+    async def _chip_info(self, refresh: bool = False) -> Union[InfoMessage, Ecode]:
+        if not refresh and self._session.info is not None:
+            return self._session.info
+
+        try:
+            info = parse_info(await self._send(Commands.GET_INFO))
+        except Exception as ex:
+            logger.error(f'Error getting chip information: {ex}.')
+            info = Ecode.GETTING_INFO_DATA_FAILED
+        self._session.info = info if isinstance(info, InfoMessage) else None
+        return info
+
+    @async_check_programmer
+    @async_check_chip
+    async def get_pgm(self) -> Union[PGMMessage, Ecode]:
+        try:
+            return parse_pgm(await self._send(Commands.GET_PGM_PARAMS))
+        except Exception as ex:
+            logger.error(f'Error getting chip pgm information: {ex}.')
+            return Ecode.GETTING_PGM_DATA_FAILED
+
+    @async_check_programmer
+    @async_check_chip
+    async def get_checksum(self) -> Union[int, Ecode]:
+        return await self._get_checksum()
+
+    async def _get_checksum(self) -> Union[int, Ecode]:
+        try:
+            return parse_checksum(await self._send(Commands.GET_CHECKSUM))
+        except Exception as ex:
+            logger.error(f'Error getting checksum: {ex}.')
+            return Ecode.GETTING_CHECKSUM_FAILED
+
+    @async_check_programmer
+    @async_check_chip
+    async def set_cursor(self, position: int) -> Ecode:
+        return await self._set_cursor(position)
+
+    async def _set_cursor(self, position: int) -> Ecode:
+        self._session.invalidate()
+        try:
+            await self._send(Commands.SET_COUNTER, convert_counter(position))
+        except Exception as ex:
+            logger.error(f'Set byte cursor failed: {ex}.')
+            return Ecode.SET_CURSOR_FAILED
+        else:
+            return Ecode.OK
+
+    @async_check_programmer
+    @async_check_chip
+    async def erase(self) -> Ecode:
+        return await self._erase()
+
+    async def _erase(self) -> Ecode:
+        self._session.invalidate()
+        try:
+            await self._send(Commands.ERASE_FLASH)
+        except Exception as ex:
+            logger.error(f'Erase chip failed: {ex}.')
+            return Ecode.ERASING_FAILED
+        else:
+            return Ecode.OK
+
+    @async_check_programmer
+    @async_check_chip
+    async def write(self, path: Union[str, bytes, FirmwareImage], window: int = 0, if_changed: bool = False,
+                    full_verify: bool = False, progress: Optional[ProgressCallback] = None) -> Ecode:
+        image = await self._chip_image(path)
+        if isinstance(image, Ecode):
+            return image
+
+        plan = await self._plan_write(image) if if_changed else WritePlan()
+        if isinstance(plan, Ecode):
+            return plan
+        self._echo(f'Write plan: {plan}.')
+        if not plan.upload:
+            return Ecode.OK
+
+        ecode = await self._set_cursor(image.occupied)
+        if ecode == Ecode.OK and plan.erase:
+            ecode = await self._erase()
+        if ecode != Ecode.OK:
+            return ecode
+
+        try:
+            if image.occupied:
+                await self._send(Commands.LOAD_FIRMWARE, image.payload, action_check=True, window=window,
+                                 progress=progress)
+        except Exception as ex:
+            logger.error(f'Write hex to chip failed: {ex}.')
+            return Ecode.WRITING_FAILED
+        finally:
+            self._session.invalidate()
+
+        return await self._verify(image, full_verify) if plan.verify else Ecode.OK
+
+    async def _chip_image(self, hex_obj: Union[str, bytes, FirmwareImage]) -> Union[FirmwareImage, Ecode]:
+        image = as_image(hex_obj)
+        if isinstance(image, Ecode):
+            return image
+        info = await self._chip_info()
+        if not isinstance(info, InfoMessage):
+            return info
+        return fit_image(image, info)
+
+    async def _plan_write(self, image: FirmwareImage) -> Union[WritePlan, Ecode]:
+        info = await self._chip_info()
+        if not isinstance(info, InfoMessage):
+            return info
+        plan = plan_write(info, image)
+        if plan is not None:
+            return plan
+
+        ecode = await self._set_cursor(len(image))
+        if ecode != Ecode.OK:
+            return ecode
+        checksum = await self._get_checksum()
+        if isinstance(checksum, Ecode):
+            return checksum
+        return plan_write(info, image, checksum)
+
+    @async_check_programmer
+    @async_check_chip
+    async def read(self, path: str, start: int = 0, length: Optional[int] = None, occupied: bool = False,
+                   min_padding: int = PADDING_RUN, progress: Optional[ProgressCallback] = None) -> Ecode:
+        info = await self._chip_info()
+        if not isinstance(info, InfoMessage):
+            return info
+
+        end = read_end(info, start, length, occupied)
+        if isinstance(end, Ecode):
+            return end
+        if end == 0:
+            return save_image(path, b'', min_padding=min_padding)
+
+        mcu_data = await self._read(end, progress)
+        if isinstance(mcu_data, Ecode):
+            return mcu_data
+        return save_image(path, mcu_data[start:], offset=start, min_padding=min_padding)
+
+    async def _read(self, cursor: int, progress: Optional[ProgressCallback] = None) -> Union[bytearray, Ecode]:
+        ecode = await self._set_cursor(cursor)
+        if ecode != Ecode.OK:
+            return ecode
+        try:
+            return await read_firmware(self._port, cursor, progress)
+        except asyncio.CancelledError:
+            await self._resync()
+            raise
+        except Exception as ex:
+            logger.error(f'Read binary string from chip failed: {ex}.')
+            await self._resync()
+            return Ecode.READING_FAILED
+
+    @async_check_programmer
+    @async_check_chip
+    async def verify(self, path: str, full: bool = False) -> Ecode:
+        return await self._verify(path, full)
+
+    async def _verify(self, hex_obj: Union[str, bytes, FirmwareImage], full: bool = False) -> Ecode:
+        image = await self._chip_image(hex_obj)
+        if isinstance(image, Ecode):
+            return image
+
+        if not full:
+            ecode = await self._set_cursor(len(image))
+            if ecode != Ecode.OK:
+                return ecode
+            checksum = await self._get_checksum()
+            if isinstance(checksum, Ecode):
+                return checksum
+            return Ecode.OK if checksum == image.checksum else Ecode.VERIFICATION_FAILED
+
+        mcu_data = await self._read(len(image))
+        if isinstance(mcu_data, Ecode):
+            return mcu_data
+        return Ecode.OK if mcu_data == image.data else Ecode.VERIFICATION_FAILED
@@ -19,8 +19,29 @@ def check_programmer(method) -> Callable:
 def check_chip(method) -> Callable:
     @functools.wraps(method)
     def foo(self, *args, **kwargs) -> Any:
-        info = self._get_info()
+        info = self._chip_info()
         if not isinstance(info, InfoMessage):
             return info
         return method(self, *args, **kwargs)
     return foo
+
+
+def async_check_programmer(method) -> Callable:
+    @functools.wraps(method)
+    async def foo(self, *args, **kwargs) -> Any:
+        async with self._lock:
+            if await self._is_connected():
+                return await method(self, *args, **kwargs)
+            else:
+                return Ecode.PROGRAMMER_DISCONNECTED
+    return foo
+
+
+def async_check_chip(method) -> Callable:
+    @functools.wraps(method)
+    async def foo(self, *args, **kwargs) -> Any:
+        info = await self._chip_info()
+        if not isinstance(info, InfoMessage):
+            return info
+        return await method(self, *args, **kwargs)
+    return foo
@@ -0,0 +1,72 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from serial.tools import list_ports
+
+from flashloader.constants import DEFAULT_BAUDRATE, Ecode
+
+from .easy_downloader import EZDLFlasher
+from .messages import InfoMessage, PortScanResult
+from .utils import is_valid_title
+
+logger = logging.getLogger('ezdl_discovery')
+
+SCAN_TIMEOUT = 0.3
+MAX_SCAN_WORKERS = 32
+
+
+def candidate_ports() -> List[Tuple[str, str]]:
+    """Serial ports known to the system with their descriptions."""
+    return [(port.device, port.description or '') for port in sorted(list_ports.comports())]
+
+
+def probe_port(device: str, baudrate: int = DEFAULT_BAUDRATE, timeout: float = SCAN_TIMEOUT, probe: bool = False,
+               description: str = '') -> PortScanResult:
+    """Look for programmer on device with GET_TITLE and for chip in its panel with GET_INFO."""
+    result = PortScanResult(device=device, description=description)
+    flasher = EZDLFlasher(verbose=False)
+    # A port without programmer must fail fast instead of being resynchronised.
+    flasher.retries = 0
+    ecode = flasher.connect(device, baudrate, timeout=timeout, timeouts={}, probe=probe)
+    if ecode != Ecode.OK:
+        result.error = ecode
+        return result
+
+    try:
+        title = flasher.get_title()
+        if isinstance(title, Ecode) or not is_valid_title(title):
+            result.error = Ecode.PROGRAMMER_NOT_FOUND
+            return result
+        result.title, result.baudrate = title, flasher.baudrate
+
+        info = flasher.get_info()
+        if isinstance(info, InfoMessage):
+            result.chip = info
+        else:
+            result.error = info
+        return result
+    finally:
+        flasher.disconnect()
+
+
+def scan(devices: Optional[Iterable[str]] = None, baudrate: int = DEFAULT_BAUDRATE, timeout: float = SCAN_TIMEOUT,
+         probe: bool = False) -> List[PortScanResult]:
+    """Probe all system serial ports, or the given devices, concurrently.
+
+    Every port is opened by its own worker with short `timeout`, so scanning takes about as long as probing
+    the slowest port. With `probe` every port is also tried on the rates from PROBE_BAUDRATES.
+    """
+    ports = candidate_ports() if devices is None else [(device, '') for device in devices]
+    if not ports:
+        return []
+
+    def job(port: Tuple[str, str]) -> PortScanResult:
+        try:
+            return probe_port(port[0], baudrate, timeout, probe, port[1])
+        except Exception as ex:
+            logger.error(f'Scanning {port[0]} failed: {ex}.')
+            return PortScanResult(device=port[0], description=port[1], error=Ecode.UNEXPECTED_ERROR)
+
+    with ThreadPoolExecutor(max_workers=min(len(ports), MAX_SCAN_WORKERS)) as pool:
+        return list(pool.map(job, ports))
@@ -1,29 +1,199 @@
 import logging
-from typing import Optional, Union
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, Optional, Sequence, TypeVar, Union
 
-import serial
-
-from flashloader.constants import Ecode, MCUMemorySize, ProgVoltages, SupportedMCU
-from flashloader.hex_processing import load_hex, save_hex
+from flashloader.constants import DEFAULT_BAUDRATE, PROBE_BAUDRATES, Ecode, MCUMemorySize
+from flashloader.hex_processing import (PADDING_RUN, FirmwareImage, calc_checksum, format_ranges, mismatched_ranges,
+                                        save_image)
+from flashloader.image_cache import as_image
+from flashloader.serialization import ImagePatcher, Patch, PatchRangeError, SerialCounter, as_patches
 
 from .decorators import check_chip, check_programmer
 from .enums import Commands
-from .messages import InfoMessage, PGMMessage
-from .utils import convert_counter, convert_str_to_enum, send_data
+from .messages import InfoMessage, PGMMessage, VerifyDiff, WritePlan
+from .profiling import ProtocolStats
+from .session import SessionState
+from .shadow import ShadowMemory
+from .utils import (Deadline, DesyncError, OperationCancelled, PaddingFeed, ProgressCallback, convert_counter, fit_image,
+                    is_valid_title, padding_pending, parse_checksum, parse_info, parse_pgm, parse_title, plan_write,
+                    read_end, read_firmware, send_data)
 
 logger = logging.getLogger('ezdl_flasher')
 
+DEFAULT_TIMEOUT = 2.0
+PROBE_TIMEOUT = 0.5
+COMMAND_TIMEOUTS = {
+    Commands.ERASE_FLASH: 10.0,
+}
+# Transaction deadline is the command timeout plus this budget for every transferred byte.
+BYTE_DEADLINE = 0.05
+RETRIES = 2
+RESYNC_ATTEMPTS = 3
+RESYNC_QUIET = 0.2
+TRANSIENT_ERRORS = (TimeoutError, DesyncError)
+
+T = TypeVar('T')
+
+if TYPE_CHECKING:
+    import serial
+
 
 class EZDLFlasher:
-    def __init__(self):
-        self._dev: Optional[serial.Serial] = None
+    def __init__(self, verbose: bool = True):
+        self.verbose = verbose
+        self._dev: Optional['serial.Serial'] = None
+        self._session = SessionState()
+        self._shadow = ShadowMemory()
+        self.timeout: Optional[float] = DEFAULT_TIMEOUT
+        self.timeouts: Dict[Commands, float] = dict(COMMAND_TIMEOUTS)
+        self.stats: Optional[ProtocolStats] = None
+        self.retries = RETRIES
+        self._cancel = threading.Event()
+        self.serial: Optional[SerialCounter] = None
+        self._patcher: Optional[ImagePatcher] = None
+
+    def _echo(self, message: str) -> None:
+        if self.verbose:
+            print(message)
+
+    def enable_stats(self) -> ProtocolStats:
+        """Start collecting per-command protocol statistics, profiling costs nothing while disabled."""
+        if self.stats is None:
+            self.stats = ProtocolStats()
+        return self.stats
+
+    def disable_stats(self) -> None:
+        self.stats = None
+
+    def enable_shadow(self) -> None:
+        """Serve reads and checksums from memory read back earlier, the chip must not be swapped meanwhile."""
+        self._shadow.enabled = True
+
+    def disable_shadow(self) -> None:
+        self._shadow.enabled = False
+        self._shadow.clear()
+
+    def cancel(self) -> None:
+        """Stop running operation from another thread, it raises OperationCancelled at the next safe point."""
+        self._cancel.set()
+
+    def reset_cancel(self) -> None:
+        self._cancel.clear()
+
+    @contextmanager
+    def _port(self, command: Commands) -> Iterator['serial.Serial']:
+        """Device configured with the response timeout of command, traced when profiling is enabled.
+
+        Cancelled transaction leaves the programmer resynchronised before OperationCancelled is raised.
+        """
+        if self._cancel.is_set():
+            self._cancel.clear()
+            raise OperationCancelled()
+        timeout = self.timeouts.get(command, self.timeout)
+        if self._dev.timeout != timeout:
+            self._dev.timeout = timeout
 
-    def _is_connected(self) -> bool:
         try:
-            if not isinstance(self._dev, serial.Serial):
+            if self.stats is None:
+                yield self._dev
+            else:
+                with self.stats.trace(self._dev, command) as dev:
+                    yield dev
+        except OperationCancelled as ex:
+            self._cancel.clear()
+            self._resync(padding_pending(command, ex.pending))
+            raise
+
+    def _deadline(self, command: Commands, size: int = 0) -> Deadline:
+        timeout = self.timeouts.get(command, self.timeout)
+        return Deadline(None if timeout is None else timeout + size * BYTE_DEADLINE, self._cancel)
+
+    def _send(self, command: Commands, data: bytes = None, **kwargs) -> str:
+        with self._port(command) as dev:
+            return send_data(dev, command, data, deadline=self._deadline(command, len(data) if data else 0),
+                             **kwargs)
+
+    def _transact(self, command: Commands, data: bytes = None, **kwargs) -> str:
+        """Send idempotent command, repeat it after resynchronisation when the transaction fails."""
+        return self._retrying(command, lambda: self._send(command, data, **kwargs))
+
+    def _retrying(self, command: Commands, action: Callable[[], T]) -> T:
+        for attempt in range(self.retries + 1):
+            try:
+                return action()
+            except TRANSIENT_ERRORS as ex:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f'{command.name} failed: {ex}, retry {attempt + 1} of {self.retries}.')
+                if not self._resync():
+                    raise
+
+    def _resync(self, pending: int = 0) -> bool:
+        """Bring programmer back to the command prompt after failed transaction.
+
+        `pending` bytes still expected by interrupted upload are fed as padding, output in flight is dropped,
+        then the programmer must answer GET_TITLE.
+        """
+        self._session.clear()
+        deadline = self._deadline(Commands.READ_FIRMWARE, 3 * max(MCUMemorySize.values()))
+        try:
+            if pending:
+                # Padding belongs to the interrupted upload, profiling counts it there.
+                with self._port(Commands.LOAD_FIRMWARE) as dev:
+                    self._feed(dev, pending, deadline)
+            with self._port(Commands.GET_TITLE) as dev:
+                self._drain(dev, deadline)
+            for _ in range(RESYNC_ATTEMPTS):
+                title = self._get_programmer_title()
+                if not isinstance(title, Ecode) and is_valid_title(title):
+                    logger.info('Programmer resynchronised.')
+                    return True
+                with self._port(Commands.GET_TITLE) as dev:
+                    self._drain(dev, deadline)
+        except Exception as ex:
+            logger.error(f'Resynchronising programmer failed: {ex}.')
+        self._session.clear()
+        return False
+
+    @staticmethod
+    def _feed(dev: 'serial.Serial', pending: int, deadline: Deadline) -> None:
+        """Feed `pending` padding bytes as decided by `PaddingFeed`."""
+        feed = PaddingFeed(pending)
+        timeout, dev.timeout = dev.timeout, RESYNC_QUIET
+        try:
+            while feed.pending > 0:
+                deadline.check('Feeding pending data')
+                accepted = feed.accept(dev.read(1))
+                if accepted is None:
+                    return
+                if not accepted:
+                    continue
+                dev.write(PaddingFeed.BYTE)
+                if not feed.acknowledged(dev.read(1)):
+                    return
+        finally:
+            dev.timeout = timeout
+
+    @staticmethod
+    def _drain(dev: 'serial.Serial', deadline: Deadline) -> None:
+        """Drop programmer output until the line stays quiet."""
+        while True:
+            deadline.check('Draining programmer output')
+            time.sleep(RESYNC_QUIET)
+            if not dev.in_waiting:
+                return
+            dev.reset_input_buffer()
+
+    def _is_connected(self, refresh: bool = False) -> bool:
+        try:
+            if self._dev is None:
                 return False
             elif not self._dev.is_open:
                 return False
+            elif not refresh and self._session.title is not None:
+                return True
             elif isinstance(self._get_programmer_title(), Ecode):
                 if self._dev is not None:
                     self._disconnect()
@@ -38,18 +208,61 @@ class EZDLFlasher:
     def device(self) -> Optional[str]:
         return self._dev.name if self._is_connected() else None
 
-    def connect(self, device: str) -> Ecode:
+    @property
+    def baudrate(self) -> Optional[int]:
+        return self._dev.baudrate if self._dev is not None else None
+
+    def connect(self, device: str, baudrate: int = DEFAULT_BAUDRATE, timeout: Optional[float] = DEFAULT_TIMEOUT,
+                timeouts: Optional[Dict[Commands, float]] = None, probe: bool = False) -> Ecode:
+        """Open programmer on device.
+
+        `timeout` limits waiting for a response, `timeouts` overrides it for single commands, None waits forever.
+        With `probe` the baud rates from PROBE_BAUDRATES are tried from the fastest one and the first rate
+        the programmer answers correctly is kept, `baudrate` is ignored.
+        """
         if self._is_connected():
             logger.info('Programmer is already connected.')
             return Ecode.OK
 
+        import serial
+
         try:
-            self._dev = serial.Serial(device, 9600)
+            self._dev = serial.Serial(device, baudrate, timeout=timeout)
         except Exception as ex:
             logger.error(f'Open programmer on {device} failed: {ex}.')
             return Ecode.CONNECTION_ERROR
 
-        return Ecode.OK if self._is_connected() else Ecode.PROGRAMMER_NOT_FOUND
+        self.timeout = timeout
+        self.timeouts = {**COMMAND_TIMEOUTS, **(timeouts or {})}
+        self._session.clear()
+        self._shadow.clear()
+        if probe:
+            return self._probe_baudrate(PROBE_BAUDRATES)
+        return Ecode.OK if self._is_connected(refresh=True) else Ecode.PROGRAMMER_NOT_FOUND
+
+    def _probe_baudrate(self, baudrates: Iterable[int]) -> Ecode:
+        timeout = self.timeout
+        self.timeout = PROBE_TIMEOUT if timeout is None else min(timeout, PROBE_TIMEOUT)
+        try:
+            for baudrate in sorted(baudrates, reverse=True):
+                self._dev.baudrate = baudrate
+                title = self._get_programmer_title()
+                if not isinstance(title, Ecode) and is_valid_title(title):
+                    logger.info(f'Programmer answered on {baudrate} baud.')
+                    return Ecode.OK
+                self._session.clear()
+                # Rest of the garbled answer must not reach the probe of the next rate.
+                try:
+                    self._drain(self._dev, Deadline(self.timeout))
+                except TimeoutError:
+                    self._dev.reset_input_buffer()
+        except Exception as ex:
+            logger.error(f'Probing baud rate failed: {ex}.')
+        finally:
+            self.timeout = timeout
+
+        self._disconnect()
+        return Ecode.PROGRAMMER_NOT_FOUND
 
     def disconnect(self) -> Ecode:
         if not self._is_connected():
@@ -67,6 +280,17 @@ class EZDLFlasher:
             return Ecode.OK
         finally:
             self._dev = None
+            self._session.clear()
+            self._shadow.clear()
+
+    def refresh(self) -> Ecode:
+        """Drop cached session state and chip memory copy, query programmer and chip again."""
+        self._session.clear()
+        self._shadow.clear()
+        if not self._is_connected(refresh=True):
+            return Ecode.PROGRAMMER_DISCONNECTED
+        info = self._chip_info(refresh=True)
+        return Ecode.OK if isinstance(info, InfoMessage) else info
 
     @check_programmer
     def get_title(self) -> Union[str, Ecode]:
@@ -74,36 +298,46 @@ class EZDLFlasher:
 
     def _get_programmer_title(self) -> Union[str, Ecode]:
         try:
-            response = send_data(self._dev, Commands.GET_TITLE)
+            response = self._send(Commands.GET_TITLE)
         except Exception as ex:
             logger.error(f'Error getting programmer title: {ex}.')
             return Ecode.GETTING_TITLE_FAILED
         else:
-            return " ".join(response.replace('>', '').split())
+            self._session.title = parse_title(response)
+            return self._session.title
 
     @check_programmer
     def get_info(self) -> Union[InfoMessage, Ecode]:
-        return self._get_info()
+        return self._chip_info(refresh=True)
+
+    def _chip_info(self, refresh: bool = False) -> Union[InfoMessage, Ecode]:
+        if not refresh and self._session.info is not None:
+            return self._session.info
+
+        info = self._get_info()
+        self._session.info = info if isinstance(info, InfoMessage) else None
+        if isinstance(info, InfoMessage):
+            self._shadow.check(info)
+        return info
+
+    def _cached(self, end: int) -> Optional[memoryview]:
+        """Chip memory up to `end` from the shadow copy, once GET_INFO confirms the same chip is in the panel."""
+        if not self._shadow.covers(0, end):
+            return None
+        info = self._chip_info(refresh=True)
+        if not isinstance(info, InfoMessage) or not self._shadow.covers(0, end):
+            return None
+        return self._shadow.view(0, end)
 
     def _get_info(self) -> Union[InfoMessage, Ecode]:
         try:
-            response = send_data(self._dev, Commands.GET_INFO)
+            response = self._transact(Commands.GET_INFO)
         except Exception as ex:
             logger.error(f'Error getting chip information: {ex}.')
             return Ecode.GETTING_INFO_DATA_FAILED
 
         try:
-            response = response.split()
-            mcu_properties = response[response.index('found') + 1].split('-')
-            if len(mcu_properties) > 1:
-                message = InfoMessage(mcu=convert_str_to_enum(mcu_properties[0], SupportedMCU),
-                                      prog_voltage_type=convert_str_to_enum(mcu_properties[1], ProgVoltages),
-                                      non_blank_bytes=int(response[response.index('nonblank') + 1]),
-                                      byte_cursor=int(response[response.index('counter') + 1]))
-            elif len(mcu_properties) == 1:
-                return Ecode.CHIP_NOT_FOUND
-            else:
-                return Ecode.UNKNOWN_CHIP
+            message = parse_info(response)
         except Exception as ex:
             logger.error(f'Generation chip info message failed: {ex}.')
             return Ecode.GENERATE_INFO_MESSAGE_FAILED
@@ -117,14 +351,13 @@ class EZDLFlasher:
 
     def _get_pgm(self) -> Union[PGMMessage, Ecode]:
         try:
-            response = send_data(self._dev, Commands.GET_PGM_PARAMS)
+            response = self._transact(Commands.GET_PGM_PARAMS)
         except Exception as ex:
             logger.error(f'Error getting chip pgm information: {ex}.')
             return Ecode.GETTING_PGM_DATA_FAILED
 
         try:
-            params = response.split()[0].split(',')
-            message = PGMMessage(mcu_postfix=int(params[0]), non_blank_bytes=int(params[1]), byte_cursor=int(params[2]))
+            message = parse_pgm(response)
         except Exception as ex:
             logger.error(f'Generation chip pgm message failed: {ex}.')
             return Ecode.GENERATE_PGM_MESSAGE_FAILED
@@ -137,33 +370,48 @@ class EZDLFlasher:
         return self._get_checksum()
 
     def _get_checksum(self) -> Union[int, Ecode]:
+        cursor = self._session.cursor
+        cached = self._cached(cursor) if cursor is not None else None
+        if cached is not None:
+            return calc_checksum(cached)
         try:
-            response = send_data(self._dev, Commands.GET_CHECKSUM)
+            response = self._transact(Commands.GET_CHECKSUM)
         except Exception as ex:
             logger.error(f'Error getting chip pgm information: {ex}.')
             return Ecode.GETTING_CHECKSUM_FAILED
         try:
-            response = response.split()
-            checksum = int(response[response.index('CHKSUM') + 2], 16)
+            checksum = parse_checksum(response)
         except Exception as ex:
             logger.error(f'Processing checksum data failed: {ex}.')
             return Ecode.CHECKSUM_PROCESSING_ERROR
         else:
             return checksum
 
+    def _checksum_up_to(self, end: int) -> Union[int, Ecode]:
+        """Checksum of memory from zero address to `end`, taken from the shadow copy when it holds the range."""
+        cached = self._cached(end)
+        if cached is not None:
+            return calc_checksum(cached)
+        ecode = self._set_cursor(end)
+        if ecode != Ecode.OK:
+            return ecode
+        return self._get_checksum()
+
     @check_programmer
     @check_chip
     def set_cursor(self, position: int) -> Ecode:
         return self._set_cursor(position)
 
     def _set_cursor(self, position: int) -> Ecode:
+        self._session.invalidate()
         try:
             counter = convert_counter(position)
-            response = send_data(self._dev, Commands.SET_COUNTER, counter)
+            response = self._transact(Commands.SET_COUNTER, counter)
         except Exception as ex:
             logger.error(f'Set byte cursor failed: {ex}.')
             return Ecode.SET_CURSOR_FAILED
         else:
+            self._session.cursor = position
             logger.debug(f'Converted counter: {counter}.')
             logger.debug(f'Set counter response: {response}')
             return Ecode.OK
@@ -174,8 +422,10 @@ class EZDLFlasher:
         return self._erase()
 
     def _erase(self) -> Ecode:
+        self._session.invalidate()
+        self._shadow.clear()
         try:
-            response = send_data(self._dev, Commands.ERASE_FLASH)
+            response = self._send(Commands.ERASE_FLASH)
         except Exception as ex:
             logger.error(f'Erase chip failed: {ex}.')
             return Ecode.ERASING_FAILED
@@ -185,72 +435,291 @@ class EZDLFlasher:
 
     @check_programmer
     @check_chip
-    def write(self, path: str) -> Ecode:
-        return self._write(path)
+    def write(self, path: Union[str, bytes, FirmwareImage], window: int = 0, if_changed: bool = False,
+              full_verify: bool = False, progress: Optional[ProgressCallback] = None,
+              patches: Union[str, Sequence[Patch]] = (), serialize: bool = False) -> Ecode:
+        """Program the image, with `patches` (address and bytes pairs) and the next serial number with `serialize`.
 
-    def _write(self, hex_path: str) -> Ecode:
-        hex_str = load_hex(hex_path)
-        if not isinstance(hex_str, bytes):
-            return hex_str
-
-        print(f'Data length: {len(hex_str)}')
-        ecode = self._set_cursor(len(hex_str))
-        if ecode != Ecode.OK:
-            return ecode
-        print(f'Erase chip.')
-        ecode = self._erase()
-        if ecode != Ecode.OK:
-            return ecode
+        Serial number is advanced after the unit is programmed and verified.
+        """
+        return self._write(path, window, if_changed, full_verify, progress, patches, serialize)
 
-        print(f'Write data.')
+    def set_serial(self, address: int, start: int = 1, step: int = 1, fmt: str = 'le4') -> Ecode:
+        """Configure serial number written by `write` with `serialize`, see SerialCounter for formats."""
         try:
-            response = send_data(self._dev, Commands.LOAD_FIRMWARE, hex_str, action_check=True)
+            self.serial = SerialCounter(address, start, step, fmt)
         except Exception as ex:
-            logger.error(f'Write hex to chip failed: {ex}.')
-            return Ecode.WRITING_FAILED
+            logger.error(f'Invalid serial number: {ex}.')
+            return Ecode.PROCESSING_ARGUMENT_FAILED
         else:
-            logger.debug(f'Write response: {response}')
+            return Ecode.OK
 
-        print(f'Verify.')
-        return self._verify(hex_str)
+    def _patched(self, hex_obj: Union[str, bytes, FirmwareImage], patches: Union[str, Sequence[Patch]],
+                 serialize: bool) -> Union[FirmwareImage, Ecode]:
+        """Copy of the image with per-unit data, the copy of the same base image is reused for every unit."""
+        image = as_image(hex_obj)
+        if isinstance(image, Ecode):
+            return image
+        if serialize and self.serial is None:
+            logger.error('Serial number is not configured.')
+            return Ecode.PROCESSING_ARGUMENT_FAILED
+
+        try:
+            patches = as_patches(patches)
+            if serialize:
+                patches.append(self.serial.patch())
+            if self._patcher is None or self._patcher.base is not image:
+                self._patcher = ImagePatcher(image)
+            return self._patcher.apply(patches)
+        except PatchRangeError as ex:
+            logger.error(f'Patching image failed: {ex}.')
+            return Ecode.INVALID_MEMORY_RANGE
+        except Exception as ex:
+            logger.error(f'Invalid patches: {ex}.')
+            return Ecode.PROCESSING_ARGUMENT_FAILED
+
+    def _chip_image(self, hex_obj: Union[str, bytes, FirmwareImage]) -> Union[FirmwareImage, Ecode]:
+        image = as_image(hex_obj)
+        if isinstance(image, Ecode):
+            return image
+        info = self._chip_info()
+        if not isinstance(info, InfoMessage):
+            return info
+        return fit_image(image, info)
+
+    def _plan_write(self, image: FirmwareImage) -> Union[WritePlan, Ecode]:
+        info = self._chip_info()
+        if not isinstance(info, InfoMessage):
+            return info
+        plan = plan_write(info, image)
+        if plan is not None:
+            return plan
+
+        checksum = self._checksum_up_to(len(image))
+        if isinstance(checksum, Ecode):
+            return checksum
+        return plan_write(info, image, checksum)
+
+    def _write(self, hex_obj: Union[str, bytes, FirmwareImage], window: int = 0, if_changed: bool = False,
+               full_verify: bool = False, progress: Optional[ProgressCallback] = None,
+               patches: Union[str, Sequence[Patch]] = (), serialize: bool = False) -> Ecode:
+        if patches or serialize:
+            hex_obj = self._patched(hex_obj, patches, serialize)
+            if isinstance(hex_obj, Ecode):
+                return hex_obj
+        image = self._chip_image(hex_obj)
+        if isinstance(image, Ecode):
+            return image
+
+        if serialize:
+            self._echo(f'Serial number: {self.serial.value}.')
+        ecode = self._program(image, window, if_changed, full_verify, progress)
+        if ecode == Ecode.OK and serialize:
+            self.serial.advance()
+        return ecode
+
+    def _program(self, image: FirmwareImage, window: int = 0, if_changed: bool = False, full_verify: bool = False,
+                 progress: Optional[ProgressCallback] = None) -> Ecode:
+        self._echo(f'Data length: {len(image)}, without trailing padding: {image.occupied}')
+        plan = self._plan_write(image) if if_changed else WritePlan()
+        if isinstance(plan, Ecode):
+            return plan
+        self._echo(f'Write plan: {plan}.')
+        if not plan.upload:
+            self._echo('Chip already holds the image.')
+            return Ecode.OK
+
+        ecode = self._upload(image, plan.erase, window, progress)
+        if ecode != Ecode.OK:
+            return ecode
+
+        if not plan.verify:
+            return Ecode.OK
+        self._echo('Verify.')
+        return self._verify(image, full_verify, progress)
+
+    def _upload(self, image: FirmwareImage, erase: bool, window: int = 0,
+                progress: Optional[ProgressCallback] = None) -> Ecode:
+        """Program the image, failed upload is restarted from erasing after resynchronisation."""
+        written = 0
+
+        def track(done: int, total: int) -> None:
+            nonlocal written
+            written = done
+
+        for attempt in range(self.retries + 1):
+            # Programming stops at the last non padding byte, erased tail is checked by verification.
+            ecode = self._set_cursor(image.occupied)
+            if ecode != Ecode.OK:
+                return ecode
+            if erase or attempt:
+                self._echo('Erase chip.')
+                ecode = self._erase()
+                if ecode != Ecode.OK:
+                    return ecode
+
+            self._echo('Write data.')
+            written = 0
+            try:
+                response = self._send(Commands.LOAD_FIRMWARE, image.payload, action_check=True, window=window,
+                                      progress=progress, sent=track) if image.occupied else None
+            except TRANSIENT_ERRORS as ex:
+                logger.error(f'Write hex to chip failed after {written} bytes sent: {ex}.')
+                if attempt == self.retries or not self._resync(image.occupied - written):
+                    return Ecode.WRITING_FAILED
+                self._echo(f'Restart writing, retry {attempt + 1} of {self.retries}.')
+            except Exception as ex:
+                logger.error(f'Write hex to chip failed: {ex}.')
+                return Ecode.WRITING_FAILED
+            else:
+                logger.debug(f'Write response: {response}')
+                return Ecode.OK
+            finally:
+                self._session.invalidate()
+                self._shadow.clear()
 
     @check_programmer
     @check_chip
-    def read(self, path: str):
-        mcu_data = self._read()
-        return save_hex(path, mcu_data)
+    def read(self, path: str, start: int = 0, length: Optional[int] = None, occupied: bool = False,
+             min_padding: int = PADDING_RUN, progress: Optional[ProgressCallback] = None) -> Ecode:
+        """Save chip memory to Intel HEX file, or raw binary file for .bin path.
+
+        By default the whole memory is read, `occupied` limits reading to the non blank bytes reported by
+        the chip, `start` and `length` select an explicit range. The programmer always reads from zero address,
+        so only the bytes up to the end of the range are transferred. Runs of at least `min_padding` 0xFF
+        bytes are left out of hex file, binary file holds the range as is.
+        """
+        info = self._chip_info()
+        if not isinstance(info, InfoMessage):
+            return info
 
-    def _read(self, cursor: int = None) -> Union[bytes, Ecode]:
-        info = self._get_info()
+        end = read_end(info, start, length, occupied)
+        if isinstance(end, Ecode):
+            return end
+        if end == 0:
+            return save_image(path, b'', min_padding=min_padding)
+
+        mcu_data = self._read(end, progress)
+        if isinstance(mcu_data, Ecode):
+            return mcu_data
+        return save_image(path, mcu_data[start:], offset=start, min_padding=min_padding)
+
+    def _read(self, cursor: int = None, progress: Optional[ProgressCallback] = None,
+              cached: bool = True) -> Union[bytearray, Ecode]:
+        """Read `cursor` bytes from zero address, `progress` is called with decoded and expected byte counts.
+
+        With `cached` false all bytes come from the chip, skipping the shadow copy.
+        """
+        info = self._chip_info()
         if not isinstance(info, InfoMessage):
             return info
 
         memorysize = cursor if isinstance(cursor, int) else MCUMemorySize.get(info.mcu) - 1
-        ecode = self._set_cursor(memorysize)
+        known = self._cached(memorysize) if cached else None
+        if known is not None:
+            if progress is not None:
+                progress(memorysize, memorysize)
+            return bytearray(known)
+
+        # Dump always starts at zero address, known bytes after the last missing range are not transferred.
+        missing = self._shadow.missing(0, memorysize) if cached and self._shadow.enabled else [(0, memorysize)]
+        fetch = missing[-1][1] if missing else memorysize
+        ecode = self._set_cursor(fetch)
         if ecode != Ecode.OK:
             return ecode
         try:
-            response = send_data(self._dev, Commands.READ_FIRMWARE)
-            response = bytes.fromhex(response)
+            response = self._retrying(Commands.READ_FIRMWARE,
+                                      lambda: self._receive_firmware(fetch, memorysize, progress))
         except Exception as ex:
             logger.error(f'Read binary string from chip failed: {ex}.')
             return Ecode.READING_FAILED
-        else:
-            return response
+
+        info = self._chip_info()
+        if isinstance(info, InfoMessage):
+            self._shadow.store(info, 0, response)
+        if fetch < memorysize:
+            if not self._shadow.covers(fetch, memorysize):
+                # Chip was changed meanwhile and the rest of its memory is unknown.
+                return self._read(memorysize, progress)
+            response += self._shadow.view(fetch, memorysize)
+            if progress is not None:
+                progress(memorysize, memorysize)
+        return response
+
+    def _receive_firmware(self, length: int, total: int,
+                          progress: Optional[ProgressCallback] = None) -> bytearray:
+        with self._port(Commands.READ_FIRMWARE) as dev:
+            try:
+                for decoded, data in read_firmware(dev, length, self._deadline(Commands.READ_FIRMWARE, 3 * length)):
+                    if progress is not None:
+                        progress(decoded, total)
+            except ValueError as ex:
+                raise DesyncError(f'Malformed memory dump: {ex}') from ex
+        return data.obj  # the whole buffer behind the last view
 
     @check_programmer
     @check_chip
-    def verify(self, path: str):
-        return self._verify(path)
+    def verify(self, path: str, full: bool = False, progress: Optional[ProgressCallback] = None):
+        return self._verify(path, full, progress)
+
+    def _verify(self, hex_obj: Union[str, bytes, FirmwareImage], full: bool = False,
+                progress: Optional[ProgressCallback] = None) -> Ecode:
+        """Compare chip checksum with the image checksum, or the whole memory read back when `full` is set."""
+        image = self._chip_image(hex_obj)
+        if isinstance(image, Ecode):
+            return image
+
+        if not full:
+            checksum = self._checksum_up_to(len(image))
+            if isinstance(checksum, Ecode):
+                return checksum
+            return Ecode.OK if checksum == image.checksum else Ecode.VERIFICATION_FAILED
+
+        # Full verification is the proof the chip holds the image, it never trusts the shadow copy.
+        mcu_data = self._read(len(image), progress, cached=False)
+        if isinstance(mcu_data, Ecode):
+            return mcu_data
 
-    def _verify(self, hex_obj: Union[str, bytes]) -> Ecode:
-        if isinstance(hex_obj, str):
-            hex_obj = load_hex(hex_obj)
-        if not isinstance(hex_obj, bytes):
-            return hex_obj
+        if mcu_data == image.data:
+            return Ecode.OK
+        diff = self._diff(image, mcu_data)
+        logger.error(f'Verification failed: {diff.mismatched} bytes differ in {len(diff.ranges)} ranges, '
+                     f'{format_ranges(diff.ranges)}.')
+        return Ecode.VERIFICATION_FAILED
 
-        mcu_data = self._read(len(hex_obj))
-        if not isinstance(mcu_data, bytes):
+    @check_programmer
+    @check_chip
+    def diff(self, path: Union[str, bytes, FirmwareImage], recheck: bool = False,
+             progress: Optional[ProgressCallback] = None) -> Union[VerifyDiff, Ecode]:
+        """Read the image range back from the chip and report ranges differing from the image.
+
+        With `recheck` the differing ranges are read again, which transfers memory up to the end of the last
+        difference only, bytes differing twice are reported as `persistent`.
+        """
+        image = self._chip_image(path)
+        if isinstance(image, Ecode):
+            return image
+        mcu_data = self._read(len(image), progress, cached=False)
+        if isinstance(mcu_data, Ecode):
             return mcu_data
-
-        return Ecode.OK if mcu_data == hex_obj else Ecode.VERIFICATION_FAILED
+        diff = self._diff(image, mcu_data)
+        return self._recheck(image, diff) if recheck and not diff.ok else diff
+
+    def _diff(self, image: FirmwareImage, mcu_data: bytes) -> VerifyDiff:
+        ranges = mismatched_ranges(image.data, mcu_data)
+        # Read back bytes which differ may be the garbled ones, they must not be served from the shadow copy.
+        for start, end in ranges:
+            self._shadow.discard(start, end)
+        return VerifyDiff(length=len(image), mismatched=sum(end - start for start, end in ranges), ranges=ranges)
+
+    def _recheck(self, image: FirmwareImage, diff: VerifyDiff) -> Union[VerifyDiff, Ecode]:
+        end = diff.ranges[-1][1]
+        # Differing ranges are the only unknown part of the shadow copy, so reading stops at the last of them.
+        mcu_data = self._read(end)
+        if isinstance(mcu_data, Ecode):
+            return mcu_data
+        again = mismatched_ranges(memoryview(image.data)[:end], mcu_data)
+        persistent = [(max(first, start), min(last, stop)) for first, last in diff.ranges for start, stop in again
+                      if max(first, start) < min(last, stop)]
+        return VerifyDiff(length=diff.length, mismatched=diff.mismatched, ranges=diff.ranges, rechecked=True,
+                          persistent=persistent)
@@ -0,0 +1,190 @@
+import logging
+import os
+import pty
+import select
+import termios
+import threading
+import time
+import tty
+from collections import Counter
+from typing import Optional
+
+from flashloader.constants import DEFAULT_BAUDRATE, MCUMemorySize, ProgVoltages, SupportedMCU
+
+from .enums import ActionSignals, Commands
+
+logger = logging.getLogger('ezdl_emulator')
+
+FOOTER = b'\n\r ok\n\r >'
+TITLE = b'Easy-Downloader V1.1 for ATMEL 89C/S'
+HELP = b'g info, p pgm, c checksum, e erase, w write, r read, l lock, s counter'
+DUMP_LINE_SIZE = 16
+SEND_CHUNK_SIZE = 64
+
+
+class EmulatorStopped(Exception):
+    pass
+
+
+class EZDLEmulator:
+    """EZDL programmer emulated on a pseudo terminal, POSIX only.
+
+    Connect a flasher to `device`. Every byte sent to the host takes the line time of `baudrate`, every
+    response waits `latency` seconds first, like a USB-serial adapter does. When the host port is configured
+    with another baud rate the emulator answers with garbage. Received commands and bytes are counted for
+    benchmarks.
+    """
+
+    def __init__(self, mcu: Optional[SupportedMCU] = SupportedMCU.AT89C55, voltage: ProgVoltages = ProgVoltages.HIGH,
+                 baudrate: int = DEFAULT_BAUDRATE, latency: float = 0.0, erase_time: float = 0.0):
+        self.mcu = mcu
+        self.voltage = voltage
+        self.baudrate = baudrate
+        self.latency = latency
+        self.erase_time = erase_time
+        self.memory = bytearray(b'\xff' * MCUMemorySize.get(mcu, 0))
+        self.counter = 0
+        self.commands: Counter = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.device = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name=f'ezdl-emulator-{self.device}', daemon=True)
+
+    def __enter__(self) -> 'EZDLEmulator':
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def reset_stats(self) -> None:
+        self.commands.clear()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    @property
+    def non_blank_bytes(self) -> int:
+        return len(self.memory.rstrip(b'\xff'))
+
+    def _line_matches(self) -> bool:
+        speed = getattr(termios, f'B{self.baudrate}', None)
+        return speed is None or termios.tcgetattr(self._slave)[5] == speed
+
+    def _receive(self) -> bytes:
+        while not self._stop.is_set():
+            if select.select([self._master], [], [], 0.05)[0]:
+                byte = os.read(self._master, 1)
+                self.bytes_received += 1
+                return byte
+        raise EmulatorStopped()
+
+    def _send(self, data: bytes, turnaround: bool = True) -> None:
+        if turnaround and self.latency:
+            time.sleep(self.latency)
+        if not self._line_matches():
+            data = bytes(byte ^ 0x5A for byte in data)
+        for idx in range(0, len(data), SEND_CHUNK_SIZE):
+            chunk = data[idx:idx + SEND_CHUNK_SIZE]
+            time.sleep(len(chunk) * 10 / self.baudrate)
+            while not select.select([], [self._master], [], 0.05)[1]:
+                if self._stop.is_set():
+                    raise EmulatorStopped()
+            self.bytes_sent += len(chunk)
+            os.write(self._master, chunk)
+
+    def _serve(self) -> None:
+        handlers = {
+            Commands.GET_TITLE: self._title,
+            Commands.GET_INFO: self._info,
+            Commands.GET_PGM_PARAMS: self._pgm,
+            Commands.GET_CHECKSUM: self._checksum,
+            Commands.GET_HELP: self._help,
+            Commands.ERASE_FLASH: self._erase,
+            Commands.LOAD_FIRMWARE: self._load,
+            Commands.READ_FIRMWARE: self._dump,
+            Commands.LOCK_FLASH: self._lock,
+            Commands.SET_COUNTER: self._set_counter,
+        }
+        try:
+            while True:
+                byte = self._receive()
+                self._send(byte)
+                try:
+                    command = Commands(byte)
+                except ValueError:
+                    self._send(FOOTER, turnaround=False)
+                    continue
+                self.commands[command] += 1
+                handlers[command]()
+        except EmulatorStopped:
+            pass
+        except OSError as ex:
+            logger.debug(f'Emulator stopped: {ex}.')
+
+    def _respond(self, text: bytes) -> None:
+        self._send(b'\r\n ' + text + FOOTER, turnaround=False)
+
+    def _title(self) -> None:
+        self._respond(TITLE)
+
+    def _info(self) -> None:
+        chip = f'{self.mcu.value}-{self.voltage.value}' if self.mcu is not None else 'none'
+        self._respond(f'found {chip} nonblank {self.non_blank_bytes} counter {self.counter}'.encode())
+
+    def _pgm(self) -> None:
+        postfix = self.mcu.value[-2:] if self.mcu is not None else '0'
+        self._send(f'{postfix},{self.non_blank_bytes},{self.counter}'.encode() + FOOTER, turnaround=False)
+
+    def _checksum(self) -> None:
+        self._respond(f'CHKSUM = {sum(self.memory[:self.counter]) & 0xFFFF:04X}'.encode())
+
+    def _help(self) -> None:
+        self._respond(HELP)
+
+    def _lock(self) -> None:
+        self._respond(b'locked')
+
+    def _erase(self) -> None:
+        time.sleep(self.erase_time)
+        self.memory[:] = b'\xff' * len(self.memory)
+        self._respond(b'erased')
+
+    def _set_counter(self) -> None:
+        digits = b''
+        while True:
+            self._send(ActionSignals.XON, turnaround=False)
+            byte = self._receive()
+            self._send(byte)
+            if byte == b'\n':
+                break
+            digits += byte
+        self.counter = min(int(digits or b'0'), len(self.memory))
+        self._send(FOOTER, turnaround=False)
+
+    def _load(self) -> None:
+        for address in range(self.counter):
+            self._send(ActionSignals.XON, turnaround=False)
+            # Programming clears bits only, unerased cells keep their zeros.
+            self.memory[address] &= self._receive()[0]
+            self._send(ActionSignals.XOFF)
+        self._send(FOOTER, turnaround=False)
+
+    def _dump(self) -> None:
+        data = self.memory[:self.counter]
+        lines = (data[idx:idx + DUMP_LINE_SIZE].hex().upper().encode()
+                 for idx in range(0, len(data), DUMP_LINE_SIZE))
+        self._send(b'\r\n' + b'\r\n'.join(lines) + FOOTER)
@@ -0,0 +1,78 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from flashloader.constants import Ecode
+from flashloader.image_cache import load_image
+
+from .easy_downloader import EZDLFlasher
+
+logger = logging.getLogger('ezdl_gang')
+
+GangProgress = Dict[str, Tuple[int, int]]
+REPORT_INTERVAL = 0.5
+
+
+class GangFlasher:
+    """Set of programmers driven concurrently, one worker thread per device.
+
+    Every operation returns Ecode of each device, `report` callback receives progress of all devices
+    from the calling thread while operation is running.
+    """
+
+    def __init__(self, devices: Iterable[str]):
+        self._flashers = {device: EZDLFlasher(verbose=False) for device in devices}
+        self._progress: GangProgress = {device: (0, 0) for device in self._flashers}
+
+    @property
+    def devices(self) -> Tuple[str, ...]:
+        return tuple(self._flashers)
+
+    def connect(self, report: Optional[Callable[[GangProgress], None]] = None, **kwargs) -> Dict[str, Ecode]:
+        return self._run(lambda flasher, device, progress: flasher.connect(device, **kwargs), report)
+
+    def disconnect(self) -> Dict[str, Ecode]:
+        return self._run(lambda flasher, device, progress: flasher.disconnect())
+
+    def write(self, path: str, report: Optional[Callable[[GangProgress], None]] = None,
+              **kwargs) -> Dict[str, Ecode]:
+        image = load_image(path)
+        if isinstance(image, Ecode):
+            return {device: image for device in self._flashers}
+        return self._run(lambda flasher, device, progress: flasher.write(image, progress=progress, **kwargs),
+                         report)
+
+    def verify(self, path: str, full: bool = False,
+               report: Optional[Callable[[GangProgress], None]] = None) -> Dict[str, Ecode]:
+        image = load_image(path)
+        if isinstance(image, Ecode):
+            return {device: image for device in self._flashers}
+        return self._run(lambda flasher, device, progress: flasher.verify(image, full), report)
+
+    def read(self, path_template: str, report: Optional[Callable[[GangProgress], None]] = None,
+             **kwargs) -> Dict[str, Ecode]:
+        """Read every chip to its own file, `{device}` in path template is replaced with device name."""
+        return self._run(lambda flasher, device, progress: flasher.read(
+            path_template.format(device=os.path.basename(device)), progress=progress, **kwargs), report)
+
+    def _run(self, action: Callable, report: Optional[Callable[[GangProgress], None]] = None) -> Dict[str, Ecode]:
+        def job(device: str) -> Ecode:
+            def progress(done: int, total: int) -> None:
+                self._progress[device] = (done, total)
+
+            try:
+                return action(self._flashers[device], device, progress)
+            except Exception as ex:
+                logger.error(f'Gang job on {device} failed: {ex}.')
+                return Ecode.UNEXPECTED_ERROR
+
+        self._progress = {device: (0, 0) for device in self._flashers}
+        with ThreadPoolExecutor(max_workers=max(len(self._flashers), 1)) as pool:
+            futures = {device: pool.submit(job, device) for device in self._flashers}
+            pending = set(futures.values())
+            while pending:
+                _, pending = wait(pending, timeout=REPORT_INTERVAL)
+                if report is not None:
+                    report(dict(self._progress))
+        return {device: future.result() for device, future in futures.items()}
@@ -1,16 +1,102 @@
-from pydantic import BaseModel
+from typing import Any, Dict
 
-from flashloader.constants import ProgVoltages, SupportedMCU
+from flashloader.constants import Ecode, ProgVoltages, SupportedMCU
 
 
-class InfoMessage(BaseModel):
-    mcu: SupportedMCU
-    prog_voltage_type: ProgVoltages
-    non_blank_bytes: int
-    byte_cursor: int
+class Message:
+    """Slotted record with typed fields.
 
+    Values are converted to field types on creation and invalid ones raise ValueError. Fields listed in
+    `_defaults` are optional, a None default allows None value.
+    """
+    __slots__ = ()
+    _types: Dict[str, type] = {}
+    _defaults: Dict[str, Any] = {}
 
-class PGMMessage(BaseModel):
-    mcu_postfix: int
-    non_blank_bytes: int
-    byte_cursor: int
+    def __init__(self, **values):
+        unknown = set(values) - set(self._types)
+        if unknown:
+            raise ValueError(f'{type(self).__name__}: unexpected fields {", ".join(sorted(unknown))}')
+        for name, kind in self._types.items():
+            if name in values:
+                value = values[name]
+            elif name in self._defaults:
+                value = self._defaults[name]
+            else:
+                raise ValueError(f'{type(self).__name__}.{name}: field required')
+            setattr(self, name, self._convert(name, kind, value))
+
+    def _convert(self, name: str, kind: type, value: Any) -> Any:
+        if isinstance(value, kind) and not (kind is int and isinstance(value, bool)):
+            return value
+        if value is None and name in self._defaults and self._defaults[name] is None:
+            return None
+        try:
+            if kind is bool and value not in (0, 1):
+                raise ValueError('value is not boolean')
+            if isinstance(value, dict) and issubclass(kind, Message):
+                return kind(**value)
+            return kind(value)
+        except (TypeError, ValueError) as ex:
+            raise ValueError(f'{type(self).__name__}.{name}: invalid value {value!r}, {ex}') from None
+
+    def dict(self) -> Dict[str, Any]:
+        return {name: value.dict() if isinstance(value, Message) else value
+                for name, value in ((name, getattr(self, name)) for name in self._types)}
+
+    def __eq__(self, other: Any) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._types)
+
+    def __str__(self) -> str:
+        return ' '.join(f'{name}={getattr(self, name)!r}' for name in self._types)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({", ".join(f"{name}={getattr(self, name)!r}" for name in self._types)})'
+
+
+class InfoMessage(Message):
+    __slots__ = ('mcu', 'prog_voltage_type', 'non_blank_bytes', 'byte_cursor')
+    _types = {'mcu': SupportedMCU, 'prog_voltage_type': ProgVoltages, 'non_blank_bytes': int, 'byte_cursor': int}
+
+
+class PGMMessage(Message):
+    __slots__ = ('mcu_postfix', 'non_blank_bytes', 'byte_cursor')
+    _types = {'mcu_postfix': int, 'non_blank_bytes': int, 'byte_cursor': int}
+
+
+class WritePlan(Message):
+    __slots__ = ('erase', 'upload', 'verify')
+    _types = {'erase': bool, 'upload': bool, 'verify': bool}
+    _defaults = {'erase': True, 'upload': True, 'verify': True}
+
+
+class VerifyDiff(Message):
+    """Ranges of chip memory differing from the image, `persistent` ranges differed again when read back twice."""
+    __slots__ = ('length', 'mismatched', 'ranges', 'rechecked', 'persistent')
+    _types = {'length': int, 'mismatched': int, 'ranges': list, 'rechecked': bool, 'persistent': list}
+    _defaults = {'rechecked': False, 'persistent': None}
+
+    @property
+    def ok(self) -> bool:
+        return not self.ranges
+
+    @property
+    def transient(self) -> bool:
+        """Differences were not read back again, they came from the transfer rather than from memory cells."""
+        return self.rechecked and not self.ok and not self.persistent
+
+
+class PortScanResult(Message):
+    __slots__ = ('device', 'description', 'title', 'baudrate', 'chip', 'error')
+    _types = {'device': str, 'description': str, 'title': str, 'baudrate': int, 'chip': InfoMessage, 'error': Ecode}
+    _defaults = {'description': '', 'title': None, 'baudrate': None, 'chip': None, 'error': None}
+
+    @property
+    def has_programmer(self) -> bool:
+        return self.title is not None
+
+    @property
+    def has_chip(self) -> bool:
+        return self.chip is not None
@@ -0,0 +1,109 @@
+import json
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator
+
+from .enums import ActionSignals, Commands
+
+if TYPE_CHECKING:
+    import serial
+
+
+class CommandStats:
+    """Totals of one protocol command.
+
+    `read_wait` is the time blocked in serial reads, `xon_stall` is the part of it spent in reads which
+    returned XON only, waiting for the programmer to allow the next byte. Echo and XOFF waits are not stalls.
+    """
+    __slots__ = ('count', 'total_time', 'max_time', 'bytes_sent', 'bytes_received', 'read_wait', 'xon_stall',
+                 'echo_mismatches')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.read_wait = 0.0
+        self.xon_stall = 0.0
+        self.echo_mismatches = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result['mean_time'] = self.total_time / self.count if self.count else 0.0
+        return result
+
+
+class TracedSerial:
+    """Serial device proxy counting traffic and read waits of the traced command."""
+
+    def __init__(self, dev: 'serial.Serial', stats: CommandStats):
+        self._dev = dev
+        self._stats = stats
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._dev, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # Settings like timeout belong to the port, profiling must not change protocol timing.
+        if name.startswith('_'):
+            super().__setattr__(name, value)
+        else:
+            setattr(self._dev, name, value)
+
+    def write(self, data) -> int:
+        self._stats.bytes_sent += len(data)
+        return self._dev.write(data)
+
+    def _traced_read(self, read, *args, **kwargs) -> bytes:
+        started = time.perf_counter()
+        data = read(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        self._stats.bytes_received += len(data)
+        self._stats.read_wait += elapsed
+        if data and data == ActionSignals.XON * len(data):
+            self._stats.xon_stall += elapsed
+        return data
+
+    def read(self, size: int = 1) -> bytes:
+        return self._traced_read(self._dev.read, size)
+
+    def read_until(self, expected: bytes = b'\n', size=None) -> bytes:
+        return self._traced_read(self._dev.read_until, expected, size)
+
+    def note_mismatch(self) -> None:
+        self._stats.echo_mismatches += 1
+
+
+class ProtocolStats:
+    """Per-command protocol statistics collected by a flasher while profiling is enabled."""
+
+    def __init__(self):
+        self.commands: Dict[Commands, CommandStats] = {}
+
+    @contextmanager
+    def trace(self, dev: 'serial.Serial', command: Commands) -> Iterator[TracedSerial]:
+        stats = self.commands.setdefault(command, CommandStats())
+        started = time.perf_counter()
+        try:
+            yield TracedSerial(dev, stats)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.count += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+
+    def reset(self) -> None:
+        self.commands.clear()
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {command.name: stats.to_dict() for command, stats in self.commands.items()}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+
+def note_mismatch(dev: Any) -> None:
+    """Count handshake or echo mismatch when the device is traced."""
+    if isinstance(dev, TracedSerial):
+        dev.note_mismatch()
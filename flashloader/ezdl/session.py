@@ -0,0 +1,51 @@
+import time
+from typing import Optional
+
+from .messages import InfoMessage
+
+SESSION_TTL = 2.0
+
+
+class SessionState:
+    """Programmer title and chip information received during the session, valid for `ttl` seconds.
+
+    Commands changing the chip state (erase, write, set cursor) must call `invalidate`. Byte cursor set last
+    is kept until the session is cleared.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL):
+        self.ttl = ttl
+        self._title: Optional[str] = None
+        self._title_time = 0.0
+        self._info: Optional[InfoMessage] = None
+        self._info_time = 0.0
+        self.cursor: Optional[int] = None
+
+    def _is_fresh(self, timestamp: float) -> bool:
+        return time.monotonic() - timestamp < self.ttl
+
+    @property
+    def title(self) -> Optional[str]:
+        return self._title if self._title is not None and self._is_fresh(self._title_time) else None
+
+    @title.setter
+    def title(self, title: Optional[str]) -> None:
+        self._title, self._title_time = title, time.monotonic()
+
+    @property
+    def info(self) -> Optional[InfoMessage]:
+        return self._info if self._info is not None and self._is_fresh(self._info_time) else None
+
+    @info.setter
+    def info(self, info: Optional[InfoMessage]) -> None:
+        self._info, self._info_time = info, time.monotonic()
+        if info is not None:
+            self.cursor = info.byte_cursor
+
+    def invalidate(self) -> None:
+        self._info = None
+
+    def clear(self) -> None:
+        self._title = None
+        self._info = None
+        self.cursor = None
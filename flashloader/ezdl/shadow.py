@@ -0,0 +1,105 @@
+import logging
+from typing import List, Optional, Tuple
+
+from flashloader.constants import MCUMemorySize, SupportedMCU
+
+from .messages import InfoMessage
+
+logger = logging.getLogger(__name__)
+
+ChipStamp = Tuple[SupportedMCU, int]
+
+
+def chip_stamp(info: InfoMessage) -> ChipStamp:
+    return info.mcu, info.non_blank_bytes
+
+
+class ShadowMemory:
+    """Copy of chip memory read back by earlier transfers, with the ranges known to match the chip.
+
+    GET_INFO cannot tell two chips apart, so the copy is disabled by default: enabling it states that the chip
+    is not swapped while the session lasts. The stamp, the MCU and non blank byte count reported by GET_INFO,
+    only drops the copy of a chip which obviously changed. Commands changing chip memory (erase, write) must
+    call `clear`.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stamp: Optional[ChipStamp] = None
+        self._data = bytearray()
+        self._valid: List[Tuple[int, int]] = []
+
+    @property
+    def known(self) -> int:
+        """Number of bytes known to match the chip."""
+        return sum(end - start for start, end in self._valid)
+
+    def clear(self) -> None:
+        self.stamp = None
+        self._valid.clear()
+
+    def check(self, info: InfoMessage) -> bool:
+        """Drop contents when GET_INFO describes another chip than the one they were taken from."""
+        if self.stamp is None or self.stamp == chip_stamp(info):
+            return True
+        logger.info(f'Chip changed from {self.stamp} to {chip_stamp(info)}, dropping shadow memory.')
+        self.clear()
+        return False
+
+    def store(self, info: InfoMessage, start: int, data: bytes) -> None:
+        """Keep bytes read back from the chip, nothing is kept while the copy is disabled."""
+        if not self.enabled:
+            return
+        end = start + len(data)
+        size = MCUMemorySize.get(info.mcu, 0)
+        if start < 0 or end > size:
+            raise ValueError(f'Range {start}:{end} is outside of {size} bytes memory')
+        if self.stamp != chip_stamp(info):
+            self.clear()
+            self.stamp = chip_stamp(info)
+        if len(self._data) != size:
+            self._data = bytearray(b'\xff' * size)
+        if start == end:
+            return
+
+        self._data[start:end] = data
+        # Keep valid ranges sorted and merged, touching ranges become one.
+        merged = []
+        for first, last in self._valid:
+            if last < start or first > end:
+                merged.append((first, last))
+            else:
+                start, end = min(start, first), max(end, last)
+        merged.append((start, end))
+        self._valid = sorted(merged)
+
+    def discard(self, start: int, end: int) -> None:
+        """Forget range which no longer matches the chip, or which must be read again."""
+        remaining = []
+        for first, last in self._valid:
+            if first < start:
+                remaining.append((first, min(last, start)))
+            if last > end:
+                remaining.append((max(first, end), last))
+        self._valid = remaining
+
+    def missing(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """Ranges between `start` and `end` which must be read from the chip."""
+        gaps = []
+        for first, last in self._valid:
+            if last <= start:
+                continue
+            if first >= end:
+                break
+            if first > start:
+                gaps.append((start, first))
+            start = max(start, last)
+        if start < end:
+            gaps.append((start, end))
+        return gaps
+
+    def covers(self, start: int, end: int) -> bool:
+        return self.enabled and not self.missing(start, end)
+
+    def view(self, start: int, end: int) -> memoryview:
+        return memoryview(self._data)[start:end]
@@ -1,13 +1,65 @@
+import binascii
 import logging
-from typing import Type, Union
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, Tuple, Type, Union
 
-import serial
-
-from ..constants import ProgVoltages, SupportedMCU
+from ..constants import Ecode, MCUMemorySize, ProgVoltages, SupportedMCU
+from ..hex_processing import FirmwareImage
 from .enums import ActionSignals, Commands
+from .messages import InfoMessage, PGMMessage, WritePlan
+from .profiling import note_mismatch
+
+if TYPE_CHECKING:
+    import serial
 
 logger = logging.getLogger(__name__)
 
+HANDSHAKE_PAIR = ActionSignals.XON.value + ActionSignals.XOFF.value
+NON_HEX_BYTES = bytes(set(range(256)) - set(b'0123456789abcdefABCDEF'))
+READ_CHUNK_SIZE = 512
+
+ProgressCallback = Callable[[int, int], None]
+
+
+class DesyncError(RuntimeError):
+    """Programmer answered with unexpected echo or handshake byte, the byte stream is out of step."""
+
+
+class OperationCancelled(BaseException):
+    """Operation cancelled by request from another thread.
+
+    Derived from BaseException like KeyboardInterrupt, so generic error handlers of single steps do not turn
+    it into their error codes. `pending` is the number of data bytes the programmer still expects.
+    """
+
+    def __init__(self, pending: int = 0):
+        super().__init__(f'Operation cancelled, {pending} data bytes pending')
+        self.pending = pending
+
+
+class HandshakeError(DesyncError):
+    def __init__(self, offset: int, expected: bytes, received: bytes):
+        super().__init__(f'Handshake desync at byte {offset}: expected {expected}, received {received}.')
+        self.offset = offset
+
+
+class Deadline:
+    """Time limit of a whole transaction, None never expires, set `cancel` event stops the transaction."""
+
+    def __init__(self, seconds: Optional[float], cancel: Optional[threading.Event] = None):
+        self.expires = None if seconds is None else time.monotonic() + seconds
+        self.cancel = cancel
+
+    def check(self, what: str, pending: int = 0) -> None:
+        if self.cancel is not None and self.cancel.is_set():
+            raise OperationCancelled(pending)
+        if self.expires is not None and time.monotonic() > self.expires:
+            raise TimeoutError(f'{what} exceeded transaction deadline')
+
+
+NO_DEADLINE = Deadline(None)
+
 
 def convert_str_to_enum(string: str, concrete_enum: Union[Type[SupportedMCU], Type[ProgVoltages]]):
     if concrete_enum not in [SupportedMCU, ProgVoltages]:
@@ -30,11 +82,63 @@ def convert_counter(count_num: int) -> bytes:
     return bytes(count_str, encoding='utf-8')
 
 
+def parse_title(response: str) -> str:
+    return " ".join(response.replace('>', '').split())
+
+
+def is_valid_title(title: str) -> bool:
+    """Title received with wrong baud rate is garbled or empty."""
+    return bool(title) and title.isprintable()
+
+
+def parse_info(response: str) -> Union[InfoMessage, Ecode]:
+    response = response.split()
+    mcu_properties = response[response.index('found') + 1].split('-')
+    if len(mcu_properties) > 1:
+        return InfoMessage(mcu=convert_str_to_enum(mcu_properties[0], SupportedMCU),
+                           prog_voltage_type=convert_str_to_enum(mcu_properties[1], ProgVoltages),
+                           non_blank_bytes=int(response[response.index('nonblank') + 1]),
+                           byte_cursor=int(response[response.index('counter') + 1]))
+    elif len(mcu_properties) == 1:
+        return Ecode.CHIP_NOT_FOUND
+    else:
+        return Ecode.UNKNOWN_CHIP
+
+
+def parse_pgm(response: str) -> PGMMessage:
+    params = response.split()[0].split(',')
+    return PGMMessage(mcu_postfix=int(params[0]), non_blank_bytes=int(params[1]), byte_cursor=int(params[2]))
+
+
+def parse_checksum(response: str) -> int:
+    response = response.split()
+    return int(response[response.index('CHKSUM') + 2], 16)
+
+
+def read_end(info: InfoMessage, start: int = 0, length: Optional[int] = None,
+             occupied: bool = False) -> Union[int, Ecode]:
+    """End address of the memory range to read, the whole readable memory by default."""
+    memorysize = MCUMemorySize.get(info.mcu, 0)
+    if occupied and (start or length is not None):
+        logger.error('Occupied range cannot be combined with start or length.')
+        return Ecode.PROCESSING_ARGUMENT_FAILED
+    if occupied:
+        end = info.non_blank_bytes
+    elif length is not None:
+        end = start + length
+    else:
+        end = memorysize - 1
+    if not 0 <= start <= end <= memorysize:
+        logger.error(f'Invalid memory range: start {start}, end {end}, memory size {memorysize}.')
+        return Ecode.INVALID_MEMORY_RANGE
+    return end
+
+
 def cut_footer(data: str) -> str:
     return data.replace('\n\r ok\n\r >', '')
 
 
-def send_data(dev: serial.Serial, command: Commands, data: bytes = None, action_check: bool = False) -> str:
+def send_command(dev: 'serial.Serial', command: Commands) -> None:
     if not isinstance(command, Commands):
         raise ValueError(f'Expected single byte command, recieved: {command}')
 
@@ -43,30 +147,233 @@ def send_data(dev: serial.Serial, command: Commands, data: bytes = None, action_
 
     send_byte(dev, command, False)
 
-    if data:
+
+def send_data(dev: 'serial.Serial', command: Commands, data: bytes = None, action_check: bool = False,
+              window: int = 0, progress: Optional[ProgressCallback] = None, deadline: Deadline = NO_DEADLINE,
+              sent: Optional[ProgressCallback] = None) -> str:
+    """Send command with data and return response without footer.
+
+    Every read is limited by the device timeout and the whole transaction by `deadline`. Lost echo raises
+    TimeoutError, unexpected echo or handshake byte raises DesyncError. `sent` is called with the number of
+    data bytes written to the port, acknowledged or not.
+    """
+    send_command(dev, command)
+
+    if data and action_check and window > 0:
+        send_burst(dev, data, window, progress, deadline, sent)
+    elif data:
         for idx in range(len(data)):
+            deadline.check(f'Sending data of {command}', len(data) - idx)
             wait_allow_byte(dev)
-            send_byte(dev, data[idx:idx+1], action_check)
+            if sent is not None:
+                sent(idx + 1, len(data))
+            send_byte(dev, bytes(data[idx:idx+1]), action_check)
+            if progress is not None:
+                progress(idx + 1, len(data))
+
+    deadline.check(f'Sending data of {command}')
+    return parse_response(command, dev.read_until(expected=b'>'))
+
+
+def parse_response(command: Commands, data: bytes) -> str:
+    """Response without footer, the prompt must end it."""
+    if not data.endswith(b'>'):
+        raise TimeoutError(f'Response to {command} timed out, received: {data}')
+    return cut_footer(data.decode(encoding='utf-8'))
+
+
+def read_firmware(dev: 'serial.Serial', length: int,
+                  deadline: Deadline = NO_DEADLINE) -> Iterator[Tuple[int, memoryview]]:
+    """Send READ_FIRMWARE and decode the hex dump into a preallocated buffer while it arrives.
+
+    Yields number of decoded bytes and a view of the decoded data after every received chunk, the footer
+    is detected by the prompt character in the last chunk.
+    """
+    send_command(dev, Commands.READ_FIRMWARE)
+
+    decoder = HexDumpDecoder(length)
+    while not decoder.finished:
+        deadline.check('Reading firmware')
+        chunk = dev.read(max(1, min(dev.in_waiting, READ_CHUNK_SIZE)))
+        if not chunk:
+            raise TimeoutError(f'Reading firmware timed out after {decoder.decoded} of {length} bytes')
+        decoder.feed(chunk)
+        yield decoder.decoded, decoder.view
+    decoder.check()
 
-    data = dev.read_until(expected=b'>').decode(encoding='utf-8')
-    return cut_footer(data)
 
+class HexDumpDecoder:
+    """Incremental decoder of READ_FIRMWARE hex dump into a preallocated buffer."""
 
-def send_byte(dev: serial.Serial, byte: bytes, action_check):
+    def __init__(self, length: int):
+        self.buffer = bytearray(length)
+        self.decoded = 0
+        self.finished = False
+        self._digits = b''
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self.buffer)[:self.decoded]
+
+    def feed(self, chunk: bytes) -> None:
+        prompt = chunk.find(b'>')
+        if prompt >= 0:
+            chunk = chunk[:prompt]
+            self.finished = True
+
+        digits = self._digits + chunk.translate(None, NON_HEX_BYTES)
+        count = min(len(digits) // 2, len(self.buffer) - self.decoded)
+        self.buffer[self.decoded:self.decoded + count] = binascii.unhexlify(digits[:2 * count])
+        self._digits = digits[2 * count:]
+        self.decoded += count
+
+    def check(self) -> None:
+        if self.decoded != len(self.buffer) or self._digits:
+            raise ValueError(f'Unexpected firmware length: {self.decoded} bytes and {len(self._digits)} digits, '
+                             f'{len(self.buffer)} expected')
+
+
+def send_byte(dev: 'serial.Serial', byte: bytes, action_check):
+    check_single_byte(byte)
+    dev.write(byte)
+    check_echo(dev, byte, action_check, dev.read(1))
+
+
+def check_single_byte(byte: bytes) -> None:
     if not isinstance(byte, bytes) or len(byte) != 1:
         raise ValueError(f'Expected single byte, recieved: {byte}')
-    dev.write(byte)
-    response = dev.read(1)
+
+
+def check_echo(dev: Any, byte: bytes, action_check: bool, response: bytes) -> None:
+    """Check answer to sent byte, its echo or XOFF for data byte with handshake."""
+    if not response:
+        raise TimeoutError(f'No echo received for {byte}')
 
     check_byte = ActionSignals.XOFF if action_check else byte
 
     if check_byte != response:
         logger.error(f'send != responce: {check_byte} != {response}.')
-        # raise RuntimeError(f'send != responce')
+        note_mismatch(dev)
+        raise DesyncError(f'Expected echo {check_byte}, received {response}')
+
 
+def wait_allow_byte(dev: 'serial.Serial') -> None:
+    check_allow(dev, dev.read(1))
 
-def wait_allow_byte(dev: serial.Serial) -> None:
-    byte = dev.read(1)
+
+def check_allow(dev: Any, byte: bytes) -> None:
+    """Check XON allowing the next data byte."""
+    if not byte:
+        raise TimeoutError('Waiting allow byte timed out')
     if byte != ActionSignals.XON:
         logger.error(f'In waiting allow: {byte} != {ActionSignals.XON}.')
-        # raise RuntimeError(f'byte != ActionSignals.XON')
+        note_mismatch(dev)
+        raise DesyncError(f'Expected {ActionSignals.XON}, received {byte}')
+
+
+def send_burst(dev: 'serial.Serial', data: bytes, window: int, progress: Optional[ProgressCallback] = None,
+               deadline: Deadline = NO_DEADLINE, sent: Optional[ProgressCallback] = None) -> None:
+    """Write data in chunks of `window` bytes, checking XON/XOFF handshakes behind the writes.
+
+    No more than one window of bytes is kept unacknowledged, handshakes already received are drained after
+    every chunk. Raises HandshakeError with the offset of the first byte which was not acknowledged properly.
+    """
+    view = memoryview(data)
+    drained = 0
+    for offset in range(0, len(view), window):
+        deadline.check('Sending data burst', len(view) - offset)
+        end = min(offset + window, len(view))
+        if sent is not None:
+            sent(end, len(view))
+        dev.write(view[offset:end])
+        drained = drain_handshake(dev, drained, drain_target(drained, dev.in_waiting, end, window))
+        if progress is not None:
+            progress(drained, len(view))
+    drain_handshake(dev, drained, len(view))
+    if progress is not None:
+        progress(len(view), len(view))
+
+
+def drain_target(drained: int, waiting: int, end: int, window: int) -> int:
+    """Offset up to which handshakes are drained after writing data up to `end`.
+
+    Handshakes already received cost nothing, waiting for more is needed only to keep one window unacknowledged.
+    """
+    return min(end, max(drained + waiting // len(HANDSHAKE_PAIR), end - window))
+
+
+def drain_handshake(dev: 'serial.Serial', drained: int, until: int) -> int:
+    if until <= drained:
+        return drained
+
+    check_handshake(dev, dev.read(len(HANDSHAKE_PAIR) * (until - drained)), drained, until - drained)
+    return until
+
+
+def check_handshake(dev: Any, response: bytes, drained: int, count: int) -> None:
+    """Check XON/XOFF pairs received for `count` bytes starting from `drained` offset."""
+    expected = HANDSHAKE_PAIR * count
+    if response != expected:
+        idx = next((i for i, (a, b) in enumerate(zip(expected, response)) if a != b), len(expected))
+        note_mismatch(dev)
+        raise HandshakeError(drained + idx // len(HANDSHAKE_PAIR), expected[idx:idx + 1], response[idx:idx + 1])
+
+
+def padding_pending(command: Commands, pending: int) -> int:
+    """Data bytes to feed after interrupted `command`, only upload data can be padded harmlessly.
+
+    Other commands are left to the GET_TITLE attempts of resynchronisation.
+    """
+    return pending if command == Commands.LOAD_FIRMWARE else 0
+
+
+class PaddingFeed:
+    """Decisions of feeding bytes still expected by interrupted upload as 0xFF, which programs nothing.
+
+    One byte is written after every XON of the programmer. Handshakes of bytes written before the failure
+    are skipped, feeding stops when the programmer falls silent or answers anything but handshakes, so
+    nothing is written past the end of the upload. Reads are expected to return empty after a short quiet time.
+    """
+    BYTE = b'\xff'
+
+    def __init__(self, pending: int):
+        self.pending = pending
+        self._signal = b''
+
+    def accept(self, signal: bytes) -> Optional[bool]:
+        """Whether to write padding after `signal` from the programmer, None stops feeding."""
+        if signal == ActionSignals.XOFF:
+            return False
+        if signal not in (ActionSignals.XON, b''):
+            return None
+        self._signal = signal
+        self.pending -= 1
+        return True
+
+    def acknowledged(self, response: bytes) -> bool:
+        """Whether to go on after the answer to written padding byte."""
+        return bool(response or self._signal)
+
+
+def fit_image(image: FirmwareImage, info: InfoMessage) -> Union[FirmwareImage, Ecode]:
+    """Image checked against memory size of the chip in the panel before anything is programmed."""
+    if len(image) > MCUMemorySize.get(info.mcu, 0):
+        logger.error(f'Image of {len(image)} bytes does not fit {info.mcu.value} memory.')
+        return Ecode.INVALID_MEMORY_RANGE
+    return image
+
+
+def plan_write(info: InfoMessage, image: FirmwareImage, checksum: Optional[int] = None) -> Optional[WritePlan]:
+    """Skip erasing of blank chip, skip all steps when chip already holds the image.
+
+    None means the chip checksum up to the image length decides, the plan is made again with `checksum`.
+    """
+    if info.non_blank_bytes == 0:
+        return WritePlan(erase=False)
+    if info.non_blank_bytes != image.occupied:
+        return WritePlan()
+    if checksum is None:
+        return None
+    if checksum != image.checksum:
+        return WritePlan()
+    return WritePlan(erase=False, upload=False, verify=False)
@@ -1,15 +1,86 @@
+import binascii
 import logging
 import os
-from typing import Union
+import re
+from typing import IO, Iterator, List, Optional, Tuple, Union
 
-from intelhex import IntelHex
-
-from .constants import Ecode
+from .constants import Ecode, MCUMemorySize
 
 logger = logging.getLogger(__name__)
 
+RECORD_SIZE = 16
+PADDING_RUN = 16
+HEX_DECODER_VERSION = 3
+MAX_MEMORY_SIZE = max(MCUMemorySize.values())
+HEX_EXTENSIONS = ('.hex', '.ihx', '.ihex')
+BIN_EXTENSIONS = ('.bin',)
+HEX_FILE_BYTES = frozenset(b':0123456789ABCDEFabcdef\r\n')
+SNIFF_SIZE = 512
+
+DATA_RECORD = 0
+EOF_RECORD = 1
+SEGMENT_ADDRESS_RECORD = 2
+START_SEGMENT_RECORD = 3
+LINEAR_ADDRESS_RECORD = 4
+START_LINEAR_RECORD = 5
+
+
+class HexFormatError(ValueError):
+    def __init__(self, line: int, message: str):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+class HexRangeError(HexFormatError):
+    pass
 
-def load_hex(path: str) -> Union[bytes, Ecode]:
+
+def parse_hex(file: IO[str], memory_size: int = MAX_MEMORY_SIZE) -> bytearray:
+    """Decode Intel HEX records line by line into memory image of `memory_size` bytes.
+
+    Gaps are filled with 0xFF, the image ends at the highest written address. Raises HexFormatError on
+    malformed record or checksum and HexRangeError on data outside the memory.
+    """
+    memory = bytearray(b'\xff' * memory_size)
+    end = 0
+    base = 0
+    number = 0
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != ':':
+            raise HexFormatError(number, 'record must start with colon')
+        try:
+            record = binascii.unhexlify(line[1:])
+        except (binascii.Error, ValueError):
+            raise HexFormatError(number, 'invalid hex digits') from None
+        if len(record) < 5 or len(record) != record[0] + 5:
+            raise HexFormatError(number, 'record length does not match its byte count')
+        if sum(record) & 0xFF:
+            raise HexFormatError(number, 'invalid record checksum')
+
+        record_type = record[3]
+        payload = memoryview(record)[4:-1]
+        if record_type == DATA_RECORD:
+            address = base + (record[1] << 8 | record[2])
+            if address + len(payload) > memory_size:
+                raise HexRangeError(number, f'data at 0x{address:X} is outside of {memory_size} bytes memory')
+            memory[address:address + len(payload)] = payload
+            end = max(end, address + len(payload))
+        elif record_type == EOF_RECORD:
+            del memory[end:]
+            return memory
+        elif record_type in (SEGMENT_ADDRESS_RECORD, LINEAR_ADDRESS_RECORD):
+            if len(payload) != 2:
+                raise HexFormatError(number, 'invalid address record')
+            base = int.from_bytes(payload, 'big') << (4 if record_type == SEGMENT_ADDRESS_RECORD else 16)
+        elif record_type not in (START_SEGMENT_RECORD, START_LINEAR_RECORD):
+            raise HexFormatError(number, f'unsupported record type {record_type}')
+    raise HexFormatError(number, 'end of file record is missing')
+
+
+def load_hex(path: str, memory_size: int = MAX_MEMORY_SIZE) -> Union[bytearray, Ecode]:
     try:
         if not os.path.exists(path):
             return Ecode.FILE_NOT_EXIST
@@ -18,9 +89,11 @@ def load_hex(path: str) -> Union[bytes, Ecode]:
         return Ecode.PROCESSING_ARGUMENT_FAILED
 
     try:
-        ih = IntelHex()
-        ih.loadhex(path)
-        binstr = ih.tobinstr()
+        with open(path) as file:
+            binstr = parse_hex(file, memory_size)
+    except HexRangeError as ex:
+        logger.error(f'Hex file {path} does not fit chip memory: {ex}.')
+        return Ecode.INVALID_MEMORY_RANGE
     except Exception as ex:
         logger.error(f'Processing hex data failed: {ex}.')
         return Ecode.HEX_PROCESSING_ERROR
@@ -28,18 +101,70 @@ def load_hex(path: str) -> Union[bytes, Ecode]:
         return binstr
 
 
-def save_hex(path: str, binstr: bytes) -> Ecode:
+def is_hex_file(path: str) -> bool:
+    """Intel HEX by extension, files with unknown extension when they start with hex records."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in HEX_EXTENSIONS:
+        return True
+    if extension in BIN_EXTENSIONS:
+        return False
+    with open(path, 'rb') as file:
+        head = file.read(SNIFF_SIZE).strip()
+    return head.startswith(b':') and HEX_FILE_BYTES.issuperset(head)
+
+
+def load_bin(path: str, memory_size: int = MAX_MEMORY_SIZE) -> Union[bytes, Ecode]:
+    """Raw binary image from zero address.
+
+    The file is copied rather than mapped: build tools rewrite their outputs in place, which would change
+    a mapped image under its checksum, or kill the process by SIGBUS once the file is truncated.
+    """
+    try:
+        with open(path, 'rb') as file:
+            data = file.read(memory_size + 1)
+        if len(data) > memory_size:
+            logger.error(f'Binary file {path} does not fit {memory_size} bytes memory.')
+            return Ecode.INVALID_MEMORY_RANGE
+        return data
+    except FileNotFoundError:
+        return Ecode.FILE_NOT_EXIST
+    except Exception as ex:
+        logger.error(f'Loading binary file failed: {ex}.')
+        return Ecode.LOADING_FILE_ERROR
+
+
+def save_bin(path: str, binstr: bytes) -> Ecode:
+    try:
+        with open(path, 'wb') as file:
+            file.write(binstr)
+    except Exception as ex:
+        logger.error(f'Saving binary file failed: {ex}.')
+        return Ecode.SAVING_FILE_ERROR
+    else:
+        return Ecode.OK
+
+
+def save_image(path: str, binstr: bytes, offset: int = 0, min_padding: int = PADDING_RUN) -> Ecode:
+    """Save raw binary for .bin path, the file holds bytes from `offset` as is, Intel HEX otherwise."""
+    if os.path.splitext(path)[1].lower() in BIN_EXTENSIONS:
+        return save_bin(path, binstr)
+    return save_hex(path, binstr, offset, min_padding)
+
+
+def save_hex(path: str, binstr: bytes, offset: int = 0, min_padding: int = PADDING_RUN) -> Ecode:
+    """Save binary placed at `offset` to hex file, skipping runs of at least `min_padding` 0xFF bytes.
+
+    Shorter 0xFF runs are kept, so the data read back from the file is the same.
+    """
     try:
-        ih = IntelHex()
-        ih.frombytes(binstr)
-        ih = remove_padding_bytes(ih)
+        content = '\n'.join(hex_records(binstr, offset, min_padding)) + '\n'
     except Exception as ex:
         logger.error(f'Processing hex data failed: {ex}.')
         return Ecode.HEX_PROCESSING_ERROR
 
     try:
         with open(path, 'w') as file:
-            ih.tofile(file, format='hex')
+            file.write(content)
     except Exception as ex:
         logger.error(f'Saving hex file failed: {ex}.')
         return Ecode.SAVING_FILE_ERROR
@@ -47,6 +172,95 @@ def save_hex(path: str, binstr: bytes) -> Ecode:
         return Ecode.OK
 
 
-def remove_padding_bytes(ih: IntelHex) -> IntelHex:
-    ih_dict = {k: v for k, v in ih.todict().items() if v != 0xFF}
-    return IntelHex(ih_dict)
+def occupied_length(binstr: bytes) -> int:
+    """Length of the image without trailing 0xFF padding."""
+    return len(bytes(binstr).rstrip(b'\xff'))
+
+
+def calc_checksum(binstr: bytes) -> int:
+    """Checksum calculated by programmer CHKSUM command: 16 bit sum of bytes from zero address to byte cursor."""
+    return sum(binstr) & 0xFFFF
+
+
+def occupied_segments(binstr: bytes, min_padding: int = PADDING_RUN) -> List[Tuple[int, int]]:
+    """Start and end offsets of data separated by runs of at least `min_padding` 0xFF bytes."""
+    if min_padding < 1:
+        raise ValueError(f'Invalid padding run length: {min_padding}')
+
+    segments, start = [], 0
+    for run in re.finditer(b'\xff{%d,}' % min_padding, binstr):
+        if run.start() > start:
+            segments.append((start, run.start()))
+        start = run.end()
+    if start < len(binstr):
+        segments.append((start, len(binstr)))
+    return segments
+
+
+def mismatched_ranges(expected: bytes, actual: bytes) -> List[Tuple[int, int]]:
+    """Start and end offsets of runs of differing bytes, bytes missing in the shorter buffer differ.
+
+    Buffers are compared as big integers, so the whole comparison runs in C.
+    """
+    common = min(len(expected), len(actual))
+    difference = int.from_bytes(expected[:common], 'big') ^ int.from_bytes(actual[:common], 'big')
+    ranges = [run.span() for run in re.finditer(b'[^\x00]+', difference.to_bytes(common, 'big'))]
+    if common < max(len(expected), len(actual)):
+        if ranges and ranges[-1][1] == common:
+            ranges[-1] = (ranges[-1][0], max(len(expected), len(actual)))
+        else:
+            ranges.append((common, max(len(expected), len(actual))))
+    return ranges
+
+
+def format_ranges(ranges: List[Tuple[int, int]], limit: int = 8) -> str:
+    """Inclusive address ranges, like `0x0010-0x001F, 0x0100, 3 more`."""
+    items = [f'0x{start:04X}' if end - start == 1 else f'0x{start:04X}-0x{end - 1:04X}' for start, end in ranges[:limit]]
+    if len(ranges) > limit:
+        items.append(f'{len(ranges) - limit} more')
+    return ', '.join(items) or 'none'
+
+
+def hex_record(address: int, record_type: int, payload: bytes = b'') -> str:
+    record = bytes((len(payload), address >> 8 & 0xFF, address & 0xFF, record_type)) + payload
+    return f':{binascii.hexlify(record).decode().upper()}{-sum(record) & 0xFF:02X}'
+
+
+def hex_records(binstr: bytes, offset: int = 0, min_padding: int = PADDING_RUN) -> Iterator[str]:
+    """Intel HEX records of occupied segments, written straight from the buffer."""
+    view = memoryview(binstr)
+    upper = 0
+    for start, end in occupied_segments(view, min_padding):
+        address = start
+        while address < end:
+            absolute = offset + address
+            if absolute >> 16 != upper:
+                upper = absolute >> 16
+                yield hex_record(0, 4, upper.to_bytes(2, 'big'))
+            # Records never cross a 64 KB boundary.
+            size = min(RECORD_SIZE, end - address, 0x10000 - (absolute & 0xFFFF))
+            yield hex_record(absolute & 0xFFFF, 0, bytes(view[address:address + size]))
+            address += size
+    yield hex_record(0, 1)
+
+
+class FirmwareImage:
+    """Binary image with its precomputed length, programmer checksum and length without trailing padding.
+
+    `data` may be any bytes-like object, for example a memoryview of mapped file.
+    """
+    __slots__ = ('data', 'checksum', 'occupied')
+
+    def __init__(self, data: Union[bytes, memoryview], checksum: Optional[int] = None,
+                 occupied: Optional[int] = None):
+        self.data = data
+        self.checksum = calc_checksum(data) if checksum is None else checksum
+        self.occupied = occupied_length(data) if occupied is None else occupied
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def payload(self) -> Union[bytes, memoryview]:
+        """Data without trailing padding, the rest of erased chip already holds 0xFF."""
+        return memoryview(self.data)[:self.occupied]
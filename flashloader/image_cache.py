@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+from .constants import Ecode
+from .hex_processing import HEX_DECODER_VERSION, FirmwareImage, is_hex_file, load_bin, load_hex
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                         'flashloader', 'images')
+MEMORY_CACHE_SIZE = 16
+DISK_CACHE_SIZE = 64
+
+
+class ImageCache:
+    """Decoded firmware images cached in memory and on disk.
+
+    Memory entries are keyed by file path, modification time and size, disk entries by content hash, both are
+    evicted in least recently used order. Disk entries keep raw binary mapped with mmap on load and metadata
+    with length, checksum and occupied length, so a cached image is never parsed again. Raw binary files need
+    no decoding, they are copied into memory entries only.
+    """
+
+    def __init__(self, directory: Optional[str] = CACHE_DIR, memory_size: int = MEMORY_CACHE_SIZE,
+                 disk_size: int = DISK_CACHE_SIZE):
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._images: 'OrderedDict[Tuple[str, int, int], FirmwareImage]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> Union[FirmwareImage, Ecode]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return Ecode.FILE_NOT_EXIST
+        except Exception as ex:
+            logger.error(f'Error check file existing: {ex}.')
+            return Ecode.PROCESSING_ARGUMENT_FAILED
+
+        key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                return image
+
+        try:
+            hex_file = is_hex_file(path)
+        except Exception as ex:
+            logger.error(f'Reading image file failed: {ex}.')
+            return Ecode.LOADING_FILE_ERROR
+
+        image = self._decode(path) if hex_file else load_bin(path)
+        if isinstance(image, Ecode):
+            return image
+        if not isinstance(image, FirmwareImage):
+            image = FirmwareImage(image)
+
+        with self._lock:
+            self._images[key] = image
+            while len(self._images) > self.memory_size:
+                self._images.popitem(last=False)
+        return image
+
+    def _decode(self, path: str) -> Union[FirmwareImage, Ecode]:
+        try:
+            with open(path, 'rb') as file:
+                digest = hashlib.sha256(file.read()).hexdigest()
+            # Images decoded by another decoder version are never reused.
+            digest = f'{digest}-v{HEX_DECODER_VERSION}'
+        except Exception as ex:
+            logger.error(f'Reading image file failed: {ex}.')
+            return Ecode.PROCESSING_ARGUMENT_FAILED
+
+        image = self._load_stored(digest)
+        if image is None:
+            binstr = load_hex(path)
+            if isinstance(binstr, Ecode):
+                return binstr
+            image = FirmwareImage(binstr)
+            self._store(digest, image)
+        return image
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+
+    def _entry_path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.directory, digest + suffix)
+
+    def _load_stored(self, digest: str) -> Optional[FirmwareImage]:
+        if self.directory is None:
+            return None
+        try:
+            with open(self._entry_path(digest, '.json')) as file:
+                meta = json.load(file)
+            if not meta['length']:
+                return FirmwareImage(b'', meta['checksum'], meta['occupied'])
+            with open(self._entry_path(digest, '.bin'), 'rb') as file:
+                data = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+            if len(data) != meta['length']:
+                raise ValueError(f'Cached image length {len(data)} != {meta["length"]}')
+            os.utime(self._entry_path(digest, '.json'))
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            logger.warning(f'Ignoring broken cache entry {digest}: {ex}.')
+            return None
+        else:
+            return FirmwareImage(data, meta['checksum'], meta['occupied'])
+
+    def _store(self, digest: str, image: FirmwareImage) -> None:
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._replace(self._entry_path(digest, '.bin'), image.data)
+            # Metadata is written last, entry without it is never loaded.
+            metadata = {'length': len(image), 'checksum': image.checksum, 'occupied': image.occupied}
+            self._replace(self._entry_path(digest, '.json'), json.dumps(metadata).encode())
+            self._prune()
+        except Exception as ex:
+            logger.warning(f'Saving image to cache failed: {ex}.')
+
+    def _replace(self, path: str, data: bytes) -> None:
+        """Write file under a temporary name and rename it, so a file mapped by another process is never truncated."""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _prune(self) -> None:
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name.endswith('.json')]
+        entries.sort(key=os.path.getmtime)
+        for entry in entries[:max(len(entries) - self.disk_size, 0)]:
+            for path in (entry, entry[:-len('.json')] + '.bin'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+image_cache = ImageCache()
+
+
+def load_image(path: str) -> Union[FirmwareImage, Ecode]:
+    return image_cache.load(path)
+
+
+def as_image(obj: Union[str, bytes, FirmwareImage]) -> Union[FirmwareImage, Ecode]:
+    """Image from Intel HEX or raw binary file through the cache, from raw binary string, or image itself."""
+    if isinstance(obj, FirmwareImage):
+        return obj
+    if isinstance(obj, str):
+        return load_image(obj)
+    return FirmwareImage(obj)
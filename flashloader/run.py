@@ -1,7 +1,24 @@
+import argparse
+import sys
+
+from .batch import run_batch
 from .cli import FlasherCLI
 
 
 def main():
+    parser = argparse.ArgumentParser(prog='flashloader', description='Flash loader for 89C5x microcontrollers. '
+                                     'Starts interactive shell when no job is given.')
+    parser.add_argument('-j', '--job', help='run steps from JSON job file')
+    parser.add_argument('-c', '--command', action='append', dest='commands', metavar='STEP',
+                        help='run step in shell syntax, like "write image.hex --if-changed", may be repeated')
+    parser.add_argument('-k', '--keep-going', action='store_true', help='run remaining steps after a failed one')
+    parser.add_argument('-s', '--socket', nargs='?', const='', metavar='PATH',
+                        help='run steps by flasher daemon listening on socket, default socket when PATH is omitted')
+    args = parser.parse_args()
+
+    if args.job is not None or args.commands:
+        sys.exit(run_batch(args.job, args.commands, args.keep_going, args.socket))
+
     cli = FlasherCLI()
     cli.cmdloop()
 
@@ -0,0 +1,134 @@
+"""Per-unit data, like serial numbers and calibration blocks, patched into a copy of the base firmware image."""
+import re
+from typing import Iterable, List, Sequence, Tuple, Union
+
+from .hex_processing import MAX_MEMORY_SIZE, FirmwareImage, occupied_length
+
+Patch = Tuple[int, bytes]
+
+COUNTER_FORMAT = re.compile(r'(le|be|bcd|ascii)(\d+)')
+
+
+class PatchRangeError(ValueError):
+    pass
+
+
+def parse_patch(text: str) -> Patch:
+    """Patch from `ADDRESS=HEXBYTES` notation, like `0x3FF0=DEADBEEF`."""
+    address, _, data = text.partition('=')
+    if not data:
+        raise ValueError(f'Patch must look like ADDRESS=HEXBYTES: {text}')
+    return int(address, 0), bytes.fromhex(data)
+
+
+def parse_patches(text: str) -> List[Patch]:
+    """Comma separated patches, like `0x3FF0=DEADBEEF,0x3FF8=01`."""
+    return [parse_patch(item) for item in text.split(',') if item.strip()]
+
+
+def as_patches(obj: Union[str, Iterable[Sequence]]) -> List[Patch]:
+    """Patches from their text notation, or from address and bytes (or hex string) pairs of API and JSON jobs."""
+    if isinstance(obj, str):
+        return parse_patches(obj)
+    patches = []
+    for address, data in obj:
+        patches.append((int(address), bytes.fromhex(data) if isinstance(data, str) else bytes(data)))
+    return patches
+
+
+class SerialCounter:
+    """Number written at fixed address of every unit, advanced after the unit is programmed.
+
+    `fmt` is the encoding followed by its width in bytes: `le4` and `be4` for binary integers, `bcd4` for
+    packed decimal digits, `ascii8` for zero padded decimal text.
+    """
+
+    def __init__(self, address: int, start: int = 1, step: int = 1, fmt: str = 'le4'):
+        match = COUNTER_FORMAT.fullmatch(fmt)
+        if match is None or not int(match.group(2)):
+            raise ValueError(f'Unknown counter format: {fmt}')
+        self.address = address
+        self.value = start
+        self.step = step
+        self.fmt = fmt
+        self._encoding, self._width = match.group(1), int(match.group(2))
+        self.encode(start)
+
+    def encode(self, value: int) -> bytes:
+        if value < 0:
+            raise ValueError(f'Negative counter value: {value}')
+        if self._encoding in ('le', 'be'):
+            try:
+                return value.to_bytes(self._width, 'little' if self._encoding == 'le' else 'big')
+            except OverflowError:
+                raise ValueError(f'Counter value {value} does not fit {self.fmt}') from None
+        size = 2 * self._width if self._encoding == 'bcd' else self._width
+        digits = f'{value:0{size}d}'
+        if len(digits) > size:
+            raise ValueError(f'Counter value {value} does not fit {self.fmt}')
+        return bytes.fromhex(digits) if self._encoding == 'bcd' else digits.encode()
+
+    def patch(self) -> Patch:
+        return self.address, self.encode(self.value)
+
+    def advance(self) -> None:
+        self.value += self.step
+
+    def __str__(self) -> str:
+        return f'{self.value} at 0x{self.address:04X} as {self.fmt}, step {self.step}'
+
+
+class ImagePatcher:
+    """Working copy of the base image, patched per unit without decoding or copying the image again.
+
+    Patches of the previous unit are reverted before new ones are applied, checksum and occupied length are
+    corrected by the patched ranges only.
+    """
+
+    def __init__(self, base: FirmwareImage, memory_size: int = MAX_MEMORY_SIZE):
+        self.base = base
+        self._buffer = bytearray(b'\xff' * max(memory_size, len(base)))
+        self._buffer[:len(base)] = base.data
+        self._applied: List[Tuple[int, int]] = []
+
+    def apply(self, patches: Iterable[Patch]) -> FirmwareImage:
+        """Image with the patches, sharing the buffer of the patcher, so it is valid until the next call."""
+        for start, end in self._applied:
+            self._buffer[start:end] = self._original(start, end)
+
+        ranges = []
+        for address, data in patches:
+            end = address + len(data)
+            if address < 0 or end > len(self._buffer):
+                raise PatchRangeError(f'Patch {address:#06x}:{end:#06x} is outside of {len(self._buffer)} bytes memory')
+            self._buffer[address:end] = data
+            ranges.append((address, end))
+        self._applied = merge_ranges(ranges)
+
+        length = max([len(self.base)] + [end for _, end in self._applied])
+        checksum = self.base.checksum + 0xFF * (length - len(self.base))
+        occupied, rescan = self.base.occupied, False
+        for start, end in self._applied:
+            checksum += sum(self._buffer[start:end]) - sum(self._original(start, end))
+            # Patching the last occupied byte of the base image may turn it into padding.
+            rescan = rescan or start < self.base.occupied <= end
+            patched = occupied_length(self._buffer[start:end])
+            if patched:
+                occupied = max(occupied, start + patched)
+        if rescan:
+            occupied = occupied_length(self._buffer[:length])
+        return FirmwareImage(memoryview(self._buffer)[:length], checksum & 0xFFFF, occupied)
+
+    def _original(self, start: int, end: int) -> bytes:
+        data = bytes(self.base.data[start:end]) if start < len(self.base) else b''
+        return data + b'\xff' * (end - start - len(data))
+
+
+def merge_ranges(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -11,9 +11,7 @@ package_data = \
 {'': ['*']}
 
 install_requires = \
-['pyserial',
- 'intelhex',
- 'pydantic']
+['pyserial']
 
 setup_kwargs = {
     'name': 'flashloader',
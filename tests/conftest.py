@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from flashloader.constants import Ecode, SupportedMCU
+from flashloader.ezdl import EZDLFlasher
+
+try:
+    from flashloader.ezdl.emulator import EZDLEmulator
+except ImportError:
+    # The emulator needs POSIX pseudo terminals, tests of pure functions run anywhere.
+    EZDLEmulator = None
+
+BAUDRATE = 115200
+MCU = SupportedMCU.AT89C51
+IMAGE_SIZE = 1024
+
+
+@pytest.fixture
+def image() -> bytes:
+    rng = random.Random(IMAGE_SIZE)
+    return bytes(rng.getrandbits(8) for _ in range(IMAGE_SIZE))
+
+
+@pytest.fixture
+def make_emulator():
+    """Factory of started emulators, `cls` may be a subclass injecting faults."""
+    if EZDLEmulator is None:
+        pytest.skip('emulator needs POSIX pseudo terminals')
+    emulators = []
+
+    def make(cls=EZDLEmulator, mcu: SupportedMCU = MCU, baudrate: int = BAUDRATE, **kwargs):
+        emulator = cls(mcu, baudrate=baudrate, **kwargs)
+        emulator.start()
+        emulators.append(emulator)
+        return emulator
+
+    yield make
+    for emulator in emulators:
+        emulator.stop()
+
+
+@pytest.fixture
+def emulator(make_emulator):
+    return make_emulator()
+
+
+@pytest.fixture
+def connect(make_emulator):
+    """Factory of flashers connected to an emulator, disconnected after the test."""
+    flashers = []
+
+    def connect(emulator, flasher: EZDLFlasher = None, **options) -> EZDLFlasher:
+        flasher = flasher or EZDLFlasher(verbose=False)
+        options.setdefault('baudrate', emulator.baudrate)
+        options.setdefault('timeout', 0.5)
+        assert flasher.connect(emulator.device, **options) == Ecode.OK
+        flashers.append(flasher)
+        return flasher
+
+    yield connect
+    for flasher in flashers:
+        if flasher.device is not None:
+            flasher.disconnect()
+
+
+@pytest.fixture
+def flasher(emulator, connect) -> EZDLFlasher:
+    return connect(emulator)
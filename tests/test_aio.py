@@ -0,0 +1,42 @@
+"""Async flasher driven against the EZDL emulator."""
+import asyncio
+
+import pytest
+
+from flashloader.constants import Ecode
+from flashloader.ezdl import AsyncEZDLFlasher
+
+pytest.importorskip('flashloader.ezdl.emulator', reason='emulator needs POSIX pseudo terminals')
+
+CANCEL_AT = 100
+
+
+@pytest.mark.parametrize('operation', ['write', 'read'])
+def test_cancelled_async_operation_leaves_programmer_in_step(emulator, image, tmp_path, operation):
+    async def run() -> None:
+        flasher = AsyncEZDLFlasher(timeout=1.0)
+        assert await flasher.connect(emulator.device, emulator.baudrate) == Ecode.OK
+        if operation == 'read':
+            assert await flasher.write(image, window=64) == Ecode.OK
+        task = None
+
+        def cancel(done: int, _) -> None:
+            if done >= CANCEL_AT:
+                task.cancel()
+
+        if operation == 'write':
+            task = asyncio.ensure_future(flasher.write(image, progress=cancel))
+        else:
+            task = asyncio.ensure_future(flasher.read(str(tmp_path / 'dump.hex'), length=len(image), progress=cancel))
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert await flasher.write(image, window=64) == Ecode.OK
+        assert await flasher.verify(image, full=True) == Ecode.OK
+        await flasher.disconnect()
+        # A fresh session finds the programmer at the prompt as well.
+        other = AsyncEZDLFlasher(timeout=1.0)
+        assert await other.connect(emulator.device, emulator.baudrate) == Ecode.OK
+        await other.disconnect()
+
+    asyncio.run(run())
@@ -0,0 +1,14 @@
+from flashloader.cli.cli import FlasherCLI
+from flashloader.hex_processing import save_hex
+
+
+def test_gang_commands_connect_with_options(make_emulator, image, tmp_path):
+    emulators = [make_emulator(), make_emulator()]
+    path = str(tmp_path / 'image.hex')
+    save_hex(path, image)
+    devices = ' '.join(emulator.device for emulator in emulators)
+
+    shell = FlasherCLI()
+    shell.onecmd(f'gang_write {devices} {path} --baudrate {emulators[0].baudrate} --timeout 0.5')
+    for emulator in emulators:
+        assert bytes(emulator.memory[:len(image)]) == image
@@ -0,0 +1,88 @@
+"""EZDLFlasher driven against the EZDL emulator."""
+import pytest
+
+from flashloader.constants import Ecode
+from flashloader.ezdl.enums import ActionSignals, Commands
+from flashloader.ezdl.utils import OperationCancelled
+
+emulator_module = pytest.importorskip('flashloader.ezdl.emulator', reason='emulator needs POSIX pseudo terminals')
+
+CANCEL_AT = 100
+
+
+class DroppingEmulator(emulator_module.EZDLEmulator):
+    """Emulator swallowing one uploaded byte without handshake, like a programmer missing a byte."""
+
+    drop_at = 512
+
+    def _load(self) -> None:
+        for address in range(self.counter):
+            self._send(ActionSignals.XON, turnaround=False)
+            byte = self._receive()
+            if address == self.drop_at:
+                self.drop_at = None
+                byte = self._receive()
+            self.memory[address] &= byte[0]
+            self._send(ActionSignals.XOFF)
+        self._send(emulator_module.FOOTER, turnaround=False)
+
+
+@pytest.mark.parametrize('window', [0, 16])
+def test_cancelled_write_leaves_programmer_in_step(emulator, flasher, image, window):
+    def cancel(done: int, _) -> None:
+        if done >= CANCEL_AT:
+            flasher.cancel()
+
+    with pytest.raises(OperationCancelled):
+        flasher.write(image, window=window, progress=cancel)
+    assert isinstance(flasher.get_title(), str)
+    assert flasher.write(image, window=window) == Ecode.OK
+    assert flasher.verify(image, full=True) == Ecode.OK
+
+
+@pytest.mark.parametrize('options, ecode', [
+    ({'start': 100000}, Ecode.INVALID_MEMORY_RANGE),
+    ({'start': -1}, Ecode.INVALID_MEMORY_RANGE),
+    ({'start': 100, 'length': 100000}, Ecode.INVALID_MEMORY_RANGE),
+    ({'occupied': True, 'length': 16}, Ecode.PROCESSING_ARGUMENT_FAILED),
+    ({'occupied': True, 'start': 16}, Ecode.PROCESSING_ARGUMENT_FAILED),
+])
+def test_read_rejects_invalid_range(flasher, tmp_path, options, ecode):
+    path = tmp_path / 'dump.bin'
+    assert flasher.read(str(path), **options) == ecode
+    assert not path.exists()
+
+
+def test_read_from_start_to_end_of_memory(emulator, flasher, image, tmp_path):
+    assert flasher.write(image) == Ecode.OK
+    path = tmp_path / 'dump.bin'
+    assert flasher.read(str(path), start=100) == Ecode.OK
+    assert path.read_bytes() == bytes(emulator.memory[100:len(emulator.memory) - 1])
+
+
+def test_connect_probes_baudrate(make_emulator, connect):
+    emulator = make_emulator(baudrate=38400)
+    flasher = connect(emulator, baudrate=9600, probe=True)
+    assert flasher.baudrate == 38400
+    assert isinstance(flasher.get_title(), str)
+
+
+def test_resync_after_lost_handshake(make_emulator, connect, image):
+    emulator = make_emulator(DroppingEmulator)
+    flasher = connect(emulator)
+    assert flasher.write(image) == Ecode.OK
+    assert emulator.commands[Commands.LOAD_FIRMWARE] == 2
+    assert bytes(emulator.memory[:len(image)]) == image
+    assert flasher.verify(image, full=True) == Ecode.OK
+
+
+def test_diff_reports_mismatched_ranges(emulator, flasher, image):
+    assert flasher.write(image) == Ecode.OK
+    assert flasher.diff(image).ok
+
+    emulator.memory[10] ^= 0xFF
+    emulator.memory[20:23] = bytes(b ^ 0xFF for b in emulator.memory[20:23])
+    diff = flasher.diff(image, recheck=True)
+    assert diff.ranges == [(10, 11), (20, 23)]
+    assert diff.mismatched == 4
+    assert diff.persistent == diff.ranges
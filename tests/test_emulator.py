@@ -0,0 +1,19 @@
+"""Flashers driven against the EZDL emulator."""
+import pytest
+
+from flashloader.constants import Ecode
+from flashloader.hex_processing import load_hex
+
+pytest.importorskip('flashloader.ezdl.emulator', reason='emulator needs POSIX pseudo terminals')
+
+
+@pytest.mark.parametrize('window', [0, 64])
+def test_write_verify_read(emulator, flasher, image, tmp_path, window):
+    assert flasher.write(image, window=window) == Ecode.OK
+    assert bytes(emulator.memory[:len(image)]) == image
+    assert flasher.verify(image) == Ecode.OK
+    assert flasher.verify(image, full=True) == Ecode.OK
+
+    path = str(tmp_path / 'dump.hex')
+    assert flasher.read(path, length=len(image)) == Ecode.OK
+    assert bytes(load_hex(path)) == image
@@ -0,0 +1,89 @@
+import io
+
+import pytest
+
+from flashloader.constants import Ecode
+from flashloader.hex_processing import (EOF_RECORD, LINEAR_ADDRESS_RECORD, HexFormatError, HexRangeError, hex_record,
+                                        load_hex, occupied_segments, parse_hex, save_hex)
+
+EOF_LINE = hex_record(0, EOF_RECORD)
+
+
+def parse(*lines: str, memory_size: int = 64) -> bytearray:
+    return parse_hex(io.StringIO('\n'.join(lines) + '\n'), memory_size)
+
+
+def test_data_records_fill_gaps_with_padding():
+    assert parse(hex_record(2, 0, b'\x01\x02'), hex_record(6, 0, b'\x03'), EOF_LINE) == b'\xff\xff\x01\x02\xff\xff\x03'
+
+
+def test_bad_checksum():
+    line = hex_record(0, 0, b'\x01\x02')
+    with pytest.raises(HexFormatError, match='checksum'):
+        parse(line[:-2] + f'{(int(line[-2:], 16) + 1) & 0xFF:02X}', EOF_LINE)
+
+
+def test_truncated_record():
+    with pytest.raises(HexFormatError, match='byte count'):
+        parse(hex_record(0, 0, b'\x01\x02\x03')[:-4], EOF_LINE)
+
+
+def test_error_reports_line_number():
+    with pytest.raises(HexFormatError) as error:
+        parse(hex_record(0, 0, b'\x01'), 'garbage', EOF_LINE)
+    assert error.value.line == 2
+
+
+def test_data_past_memory_size():
+    with pytest.raises(HexRangeError):
+        parse(hex_record(60, 0, b'\x00' * 8), EOF_LINE)
+
+
+def test_linear_address_record():
+    lines = (hex_record(0, LINEAR_ADDRESS_RECORD, b'\x00\x01'), hex_record(4, 0, b'\xAA'), EOF_LINE)
+    memory = parse(*lines, memory_size=0x10010)
+    assert len(memory) == 0x10005
+    assert memory[0x10004] == 0xAA
+    with pytest.raises(HexRangeError):
+        parse(*lines, memory_size=0x10000)
+
+
+def test_missing_eof_record():
+    with pytest.raises(HexFormatError, match='end of file'):
+        parse(hex_record(0, 0, b'\x01'))
+
+
+def test_load_hex_maps_errors_to_ecodes(tmp_path):
+    path = tmp_path / 'fw.hex'
+    path.write_text(hex_record(0, 0, b'\x01') + '\n')
+    assert load_hex(str(path)) == Ecode.HEX_PROCESSING_ERROR
+    path.write_text(hex_record(0, 0, b'\x01' * 16) + '\n' + EOF_LINE + '\n')
+    assert load_hex(str(path), memory_size=8) == Ecode.INVALID_MEMORY_RANGE
+
+
+def test_round_trip_keeps_short_padding_runs(tmp_path):
+    data = b'\x01\x02' + b'\xff' * 3 + b'\x03' + b'\xff' * 40 + b'\x04' * 20
+    path = str(tmp_path / 'fw.hex')
+    assert save_hex(path, data, min_padding=16) == Ecode.OK
+    assert load_hex(path) == data
+    # Long run is left out of the file, short one is written.
+    records = open(path).read().split()
+    assert len(records) == 4
+    assert occupied_segments(data, 16) == [(0, 6), (46, 66)]
+
+
+def test_round_trip_above_64k(tmp_path):
+    data = bytes(range(1, 33))
+    path = str(tmp_path / 'fw.hex')
+    assert save_hex(path, data, offset=0xFFF0) == Ecode.OK
+    memory = load_hex(path, memory_size=0x10020)
+    assert memory[0xFFF0:] == data
+    assert any(record[7:9] == '04' for record in open(path).read().split())
+
+
+def test_occupied_segments_edges():
+    assert occupied_segments(b'') == []
+    assert occupied_segments(b'\xff' * 20, 16) == []
+    assert occupied_segments(b'\xff' * 16 + b'\x00', 16) == [(16, 17)]
+    with pytest.raises(ValueError):
+        occupied_segments(b'\x00', 0)
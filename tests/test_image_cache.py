@@ -0,0 +1,23 @@
+from flashloader.constants import Ecode
+from flashloader.hex_processing import MAX_MEMORY_SIZE
+from flashloader.image_cache import ImageCache
+
+
+def test_binary_image_survives_rewrite_in_place(tmp_path):
+    path = tmp_path / 'fw.bin'
+    path.write_bytes(bytes(range(1, 256)) * 4)
+    cache = ImageCache(directory=str(tmp_path / 'cache'))
+    image = cache.load(str(path))
+
+    # Build tools truncate and rewrite their outputs, the loaded image keeps its bytes and checksum.
+    with open(path, 'wb') as file:
+        file.write(b'\x01' * 16)
+    assert bytes(image.data) == bytes(range(1, 256)) * 4
+    assert image.checksum == sum(image.data) & 0xFFFF
+    assert bytes(cache.load(str(path)).data) == b'\x01' * 16
+
+
+def test_binary_image_must_fit_memory(tmp_path):
+    path = tmp_path / 'fw.bin'
+    path.write_bytes(b'\x00' * (MAX_MEMORY_SIZE + 1))
+    assert ImageCache(directory=None).load(str(path)) == Ecode.INVALID_MEMORY_RANGE
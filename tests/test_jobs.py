@@ -0,0 +1,33 @@
+import threading
+
+from flashloader.cli.cli import FlasherCLI
+from flashloader.cli.jobs import DONE
+from flashloader.ezdl import InfoMessage
+
+
+def test_cancel_after_last_transaction_does_not_stop_next_command(emulator, connect):
+    shell = connect(emulator, FlasherCLI())
+    finishing, finish = threading.Event(), threading.Event()
+
+    def action(_):
+        info = shell.get_info()
+        # Job saves its result now, no transaction is left to notice the cancel request.
+        finishing.set()
+        finish.wait()
+        return info
+
+    job = shell.jobs.submit('chip_info', action)
+    assert finishing.wait(5)
+    assert shell.jobs.cancel(job) == [job]
+    finish.set()
+    assert job.finished.wait(5)
+    assert job.state == DONE
+    assert isinstance(shell.get_info(), InfoMessage)
+
+
+def test_stray_cancel_does_not_end_shell(emulator, connect, capsys):
+    shell = connect(emulator, FlasherCLI())
+    shell.cancel()
+    assert not shell.onecmd('chip_info')
+    assert 'Cancelled.' in capsys.readouterr().out
+    assert isinstance(shell.get_info(), InfoMessage)
@@ -0,0 +1,35 @@
+import time
+
+from flashloader.ezdl.enums import ActionSignals
+from flashloader.ezdl.profiling import CommandStats, TracedSerial
+
+
+class FakePort:
+    def __init__(self, *responses: bytes):
+        self.timeout = 2.0
+        self.responses = list(responses)
+
+    def read(self, size: int = 1) -> bytes:
+        time.sleep(0.001)
+        return self.responses.pop(0)
+
+
+def test_settings_reach_the_port():
+    port = FakePort()
+    traced = TracedSerial(port, CommandStats())
+    traced.timeout = 0.2
+    assert port.timeout == 0.2
+    assert traced.timeout == 0.2
+
+
+def test_only_xon_reads_are_stalls():
+    stats = CommandStats()
+    traced = TracedSerial(FakePort(ActionSignals.XOFF, ActionSignals.XON + ActionSignals.XOFF, b'w',
+                                   ActionSignals.XON), stats)
+    for _ in range(3):
+        traced.read()
+    assert stats.read_wait > 0
+    assert stats.xon_stall == 0
+    traced.read()
+    assert 0 < stats.xon_stall <= stats.read_wait
+    assert stats.bytes_received == 5
@@ -0,0 +1,88 @@
+import pytest
+
+from flashloader.hex_processing import FirmwareImage
+from flashloader.serialization import ImagePatcher, PatchRangeError, SerialCounter, as_patches, parse_patches
+
+BASE = bytes(range(1, 33)) + b'\xff' * 8 + b'\x55' * 8
+
+
+def expected(patches) -> FirmwareImage:
+    data = bytearray(BASE)
+    for address, payload in patches:
+        data.extend(b'\xff' * (address + len(payload) - len(data)))
+        data[address:address + len(payload)] = payload
+    return FirmwareImage(bytes(data))
+
+
+@pytest.mark.parametrize('patches', [
+    [],
+    [(4, b'\x00\x00')],
+    [(30, b'\xAA\xBB\xCC\xDD')],
+    # Past the base image, the gap is padding.
+    [(60, b'\x12\x34')],
+    # Tail turned into padding, occupied length is scanned again.
+    [(40, b'\xff' * 8)],
+    [(40, b'\xff' * 8), (36, b'\x01')],
+    [(10, b'\x01\x02'), (11, b'\x03\x04')],
+])
+def test_patched_image_matches_decoded_image(patches):
+    image = ImagePatcher(FirmwareImage(BASE), memory_size=64).apply(patches)
+    reference = expected(patches)
+    assert bytes(image.data) == bytes(reference.data)
+    assert image.checksum == reference.checksum
+    assert image.occupied == reference.occupied
+
+
+def test_patches_of_previous_unit_are_reverted():
+    patcher = ImagePatcher(FirmwareImage(BASE), memory_size=64)
+    patcher.apply([(60, b'\x12\x34'), (40, b'\xff' * 8)])
+    image = patcher.apply([(0, b'\x00')])
+    reference = expected([(0, b'\x00')])
+    assert bytes(image.data) == bytes(reference.data)
+    assert (image.checksum, image.occupied) == (reference.checksum, reference.occupied)
+
+
+def test_patch_outside_memory():
+    with pytest.raises(PatchRangeError):
+        ImagePatcher(FirmwareImage(BASE), memory_size=64).apply([(63, b'\x00\x00')])
+
+
+@pytest.mark.parametrize('fmt, value, encoded', [
+    ('le4', 0x1234, b'\x34\x12\x00\x00'),
+    ('be2', 0x1234, b'\x12\x34'),
+    ('bcd2', 1234, b'\x12\x34'),
+    ('ascii6', 42, b'000042'),
+])
+def test_counter_encoding(fmt, value, encoded):
+    assert SerialCounter(0x100, start=value, fmt=fmt).encode(value) == encoded
+
+
+@pytest.mark.parametrize('fmt, value', [('le1', 256), ('be2', 0x10000), ('bcd2', 10000), ('ascii3', 1000)])
+def test_counter_overflow(fmt, value):
+    counter = SerialCounter(0, fmt=fmt)
+    with pytest.raises(ValueError):
+        counter.encode(value)
+
+
+def test_counter_rejects_bad_format_and_negative_start():
+    for fmt in ('le0', 'hex4', 'bcd'):
+        with pytest.raises(ValueError):
+            SerialCounter(0, fmt=fmt)
+    with pytest.raises(ValueError):
+        SerialCounter(0, start=-1)
+
+
+def test_counter_advance():
+    counter = SerialCounter(0x3FF0, start=9998, step=1, fmt='bcd2')
+    counter.advance()
+    assert counter.patch() == (0x3FF0, b'\x99\x99')
+    counter.advance()
+    with pytest.raises(ValueError):
+        counter.patch()
+
+
+def test_patch_notation():
+    assert parse_patches('0x10=DEAD, 32=01') == [(0x10, b'\xde\xad'), (32, b'\x01')]
+    assert as_patches([[16, 'dead'], (32, b'\x01')]) == [(16, b'\xde\xad'), (32, b'\x01')]
+    with pytest.raises(ValueError):
+        parse_patches('0x10')
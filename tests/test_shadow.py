@@ -0,0 +1,25 @@
+"""Shadow copy of chip memory kept by EZDLFlasher."""
+from flashloader.constants import Ecode
+from flashloader.hex_processing import load_hex
+
+
+def test_verify_reads_chip_despite_shadow(emulator, flasher, image, tmp_path):
+    flasher.enable_shadow()
+    assert flasher.write(image) == Ecode.OK
+    emulator.memory[10] ^= 0xFF
+    # Writing verified the checksum only, changed byte is not covered by anything read back.
+    path = str(tmp_path / 'dump.hex')
+    assert flasher.read(path, length=len(image)) == Ecode.OK
+    assert load_hex(path)[10] == emulator.memory[10]
+
+    emulator.memory[20] ^= 0xFF
+    assert flasher.verify(image, full=True) == Ecode.VERIFICATION_FAILED
+
+
+def test_disabled_shadow_reads_chip_every_time(emulator, flasher, image, tmp_path):
+    assert flasher.write(image) == Ecode.OK
+    path = str(tmp_path / 'dump.hex')
+    assert flasher.read(path, length=len(image)) == Ecode.OK
+    emulator.memory[10] ^= 0xFF
+    assert flasher.read(path, length=len(image)) == Ecode.OK
+    assert load_hex(path)[10] == emulator.memory[10]